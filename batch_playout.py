@@ -0,0 +1,100 @@
+import random
+
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed for batched playouts
+    np = None
+
+# playouts per call below which the pure-Python rollout policies are faster than this engine, which pays a fixed
+# numpy overhead per step (measured on the benchmark positions: about 8x slower at 8 playouts, even at about 128,
+# 2-4x faster from 512)
+MIN_PLAYOUTS = 256
+# sentinel values of the per-game result array, next to the player indices 0 and 1
+ONGOING = -1
+DRAW = 2
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("Batched playouts need numpy, install it with 'pip install numpy'")
+
+
+# whether the bitboards of a geometry fit the uint64 arrays the batch engine works on
+def fits(geometry):
+    return geometry.bits <= 64
+
+
+# vectorised shift-and-mask test for a line of geometry.connect cells on an array of uint64 bitboards;
+# each step doubles the run of cells a bit stands for, the last one covers whatever is left
+def has_line(masks, geometry):
+    column_height, connect = geometry.column_height, geometry.connect
+    won = np.zeros(masks.shape, dtype=bool)
+    for shift in (1, column_height, column_height + 1, column_height - 1):
+        runs, length = masks, 1
+        while length < connect:
+            step = min(length, connect - length)
+            runs = runs & (runs >> np.uint64(step * shift))
+            length += step
+        won |= runs != 0
+    return won
+
+
+# plays random games to the end from one or many positions at once, all games advancing one move per step,
+# and returns one dictionary of result counts per position (keyed by marker, "draw" for draws)
+def run_playouts(states, playouts, rng=None):
+    _require_numpy()
+    geometry = states[0].geometry if states else None
+    if any(state.geometry is not geometry for state in states):
+        raise ValueError("Batched playouts need every position to be on the same board geometry")
+    if geometry is not None and not fits(geometry):
+        raise ValueError(f"Batched playouts need boards of at most 64 bits, {geometry!r} needs {geometry.bits}")
+    if rng is None:
+        rng = np.random.default_rng(random.getrandbits(64))
+    playouts = [playouts] * len(states) if isinstance(playouts, int) else list(playouts)
+
+    # one row per playout, copied from the position it starts from
+    origin = np.repeat(np.arange(len(states)), playouts)
+    masks = np.array([state.masks for state in states], dtype=np.uint64)[origin]  # (games, 2) bitboards
+    heights = np.array([state.heights for state in states], dtype=np.int64)[origin]  # (games, columns)
+    move_count = np.array([state.move_count for state in states], dtype=np.int64)[origin]
+    to_move = np.array([state.current_player_index for state in states], dtype=np.int64)[origin]
+    start_result = []
+    for state in states:
+        if state.winner is not None:
+            start_result.append(state.player_index(state.winner))
+        elif state.is_terminal():
+            start_result.append(DRAW)
+        else:
+            start_result.append(ONGOING)
+    result = np.array(start_result, dtype=np.int64)[origin]
+
+    active = np.flatnonzero(result == ONGOING)
+    while active.size:
+        # samples a legal column per game by giving full columns a score no random draw can beat
+        game_heights = heights[active]
+        scores = rng.random((active.size, geometry.columns))
+        scores[game_heights >= geometry.rows] = -1.0
+        columns = scores.argmax(axis=1)
+
+        rows = game_heights[np.arange(active.size), columns]
+        bits = np.left_shift(np.uint64(1), (columns * geometry.column_height + rows).astype(np.uint64))
+        movers = to_move[active]
+        masks[active, movers] |= bits
+        heights[active, columns] += 1
+        move_count[active] += 1
+
+        won = has_line(masks[active, movers], geometry)
+        result[active[won]] = movers[won]
+        full = ~won & (move_count[active] == geometry.cells)
+        result[active[full]] = DRAW
+        to_move[active] ^= 1
+        active = active[result[active] == ONGOING]
+
+    # aggregates the results of every position's playouts in one pass per outcome
+    first_wins, second_wins, draws = (np.bincount(origin[result == outcome], minlength=len(states))
+                                      for outcome in (0, 1, DRAW))
+    return [
+        {state.players[0].marker: int(first_wins[index]), state.players[1].marker: int(second_wins[index]),
+         "draw": int(draws[index])}
+        for index, state in enumerate(states)
+    ]
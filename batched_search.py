@@ -0,0 +1,98 @@
+import time
+
+import batch_playout
+from mcts import MonteCarloTreeSearch
+from rollout import get_rollout_policy
+
+
+# evaluators take the selected leaves as (search, position) pairs and return the playout counts of each leaf
+
+# evaluates leaves one position at a time with the search's own playouts, for when numpy is not available
+def sequential_evaluator(leaves, playouts):
+    return [search.simulate_many(playouts, position) for search, position in leaves]
+
+
+# evaluates the leaves of all searches with a single call to the vectorised batch playout engine
+def batch_evaluator(leaves, playouts):
+    return batch_playout.run_playouts([position for _, position in leaves], playouts)
+
+
+# advances the MCTS trees of many independent games in lockstep: every step selects leaves_per_tree leaves in
+# each tree, evaluates all of those leaves together with one evaluator call and backpropagates the results into
+# each tree, so the per-call overhead of the playouts is shared by all games instead of paid per game.
+# leaves selected in the same tree within a step carry a virtual loss until their results come back, so they
+# spread over different branches instead of all landing on the current favourite
+class BatchedSearch:
+    def __init__(self, games, exploration_constant=1.41, playouts_per_leaf=16, transposition_table_size=None,
+                 evaluator=None, rollout_policy="random", leaves_per_tree=1, virtual_loss=1):
+        # one search per game; finished games get no search
+        self.searches = [None if game.is_terminal() else
+                         MonteCarloTreeSearch(game, exploration_constant, transposition_table_size, playouts_per_leaf,
+                                              rollout_policy=rollout_policy)
+                         for game in games]
+        self.playouts_per_leaf = playouts_per_leaf  # playouts per selected leaf
+        self.leaves_per_tree = leaves_per_tree  # leaves selected in every tree per step
+        self.virtual_loss = virtual_loss  # lost visits added along each pending path when selecting several leaves
+        if evaluator is None:
+            # the batch engine only plays uniformly random playouts, on boards that fit in 64 bits
+            batchable = (get_rollout_policy(rollout_policy).batchable and
+                         all(batch_playout.fits(game.geometry) for game in games))
+            evaluator = batch_evaluator if batchable and batch_playout.np is not None else sequential_evaluator
+        self.evaluator = evaluator  # callable((search, leaf position) pairs, playouts) -> list of counts
+        self.steps_completed = 0
+
+    def step(self):
+        # leaves_per_tree iterations in every tree, with all leaf evaluations batched together
+        active = [search for search in self.searches if search is not None]
+        if not active:
+            return
+        if self.leaves_per_tree == 1:
+            # the searches stay at their leaves while the leaves are evaluated
+            paths = [search.select_node() for search in active]
+            counts = self.evaluator([(search, search.state) for search in active], self.playouts_per_leaf)
+            for search, path, leaf_counts in zip(active, paths, counts):
+                search.backpropagate_counts(path, leaf_counts)
+                search.unwind(path)
+                search.iterations_completed += 1
+        else:
+            # every leaf is copied so its search can go back to the root and select the next one
+            selected = []  # (search, path) of every leaf
+            leaves = []
+            for search in active:
+                for _ in range(self.leaves_per_tree):
+                    path = search.select_node()
+                    search.add_virtual_loss(path, self.virtual_loss)
+                    selected.append((search, path))
+                    leaves.append((search, search.state.copy()))
+                    search.unwind(path)
+            counts = self.evaluator(leaves, self.playouts_per_leaf)
+            for (search, path), leaf_counts in zip(selected, counts):
+                search.remove_virtual_loss(path, self.virtual_loss)
+                search.backpropagate_counts(path, leaf_counts)
+                search.iterations_completed += 1
+        self.steps_completed += 1
+
+    def run_search(self, iterations=None, time_limit=None):
+        # runs lockstep iterations for an iteration count and/or a time limit in seconds, and returns the best
+        # move of every game (None for finished games)
+        if iterations is None and time_limit is None:
+            raise ValueError("run_search needs an iteration count, a time limit or both")
+        deadline = time.perf_counter() + time_limit if time_limit is not None else None
+        for search in self.searches:
+            if search is not None:
+                search.iterations_completed = 0
+        completed = 0
+        while iterations is None or completed < iterations:
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            self.step()
+            completed += 1
+        return self.best_moves()
+
+    def best_moves(self):
+        return [search.best_move() if search is not None else None for search in self.searches]
+
+
+# chooses a move for each of many games with one batched search
+def choose_moves(games, iterations=100, **options):
+    return BatchedSearch(games, **options).run_search(iterations)
@@ -0,0 +1,193 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+from connect_four_game import ConnectFour
+from mcts import MonteCarloTreeSearch
+from player import Player, RandomAIAgent, AStarAgent, MCTSAgent, NegamaxAgent
+from rollout import ROLLOUT_POLICIES
+from tournament import AgentConfig, play_seeded_game
+
+# fixed benchmark positions, as the columns played from the empty board
+POSITIONS = {
+    "empty": "",
+    "opening": "3323",
+    "middlegame": "103305314244",
+    "crowded": "2061420164550334",
+    "late": "634263561601161561013345",
+    "endgame": "15066632503221163335315662500110",
+}
+
+# agent pairs for the full-game benchmarks
+GAME_PAIRS = {
+    "random-vs-random": (AgentConfig(RandomAIAgent), AgentConfig(RandomAIAgent)),
+    "astar-vs-random": (AgentConfig(AStarAgent), AgentConfig(RandomAIAgent)),
+    "astar-vs-astar": (AgentConfig(AStarAgent), AgentConfig(AStarAgent)),
+    "mcts100-vs-astar": (AgentConfig(MCTSAgent, iterations=100), AgentConfig(AStarAgent)),
+    "mcts100-tactical-vs-astar": (AgentConfig(MCTSAgent, iterations=100, rollout_policy="tactical"),
+                                  AgentConfig(AStarAgent)),
+    "negamax-vs-astar": (AgentConfig(NegamaxAgent, time_limit=0.01), AgentConfig(AStarAgent)),
+}
+
+
+# builds one of the benchmark positions, with the player to move set accordingly
+def load_position(moves):
+    game = ConnectFour(Player('X'), Player('O'))
+    for column in moves:
+        game.make_move(int(column), game.players[game.current_player_index].marker)
+        game.current_player_index = (game.current_player_index + 1) % 2
+    return game
+
+
+# calls operation(repeats) several times and returns the best rate in operations per second;
+# setup, when given, runs untimed before every round
+def measure(operation, repeats, rounds, setup=None):
+    best = 0.0
+    for _ in range(rounds):
+        if setup is not None:
+            setup()
+        start_time = time.perf_counter()
+        operation(repeats)
+        elapsed = time.perf_counter() - start_time
+        best = max(best, repeats / elapsed if elapsed > 0 else float('inf'))
+    return best
+
+
+# engine and evaluation operations, each run on every benchmark position
+def micro_benchmarks(scale, rounds):
+    results = {}
+    repeats = 20000 * scale
+    agent = AStarAgent('X')
+    for name, moves in POSITIONS.items():
+        game = load_position(moves)
+        column = game.get_valid_moves()[0]
+        marker = game.players[game.current_player_index].marker
+
+        def make_and_unmake(n):
+            for _ in range(n):
+                game.make_move(column, marker)
+                game.unmake_move(column)
+
+        def check_win(n):
+            for _ in range(n):
+                game.check_win(marker)
+
+        def copy(n):
+            for _ in range(n):
+                game.copy()
+
+        def get_valid_moves(n):
+            for _ in range(n):
+                game.get_valid_moves()
+
+        def heuristic_evaluation(n):
+            # scores the windows directly: heuristic_evaluation itself would time evaluation cache hits
+            for _ in range(n):
+                agent.score_windows(game, game.geometry.windows, 'X')
+
+        for operation in (make_and_unmake, check_win, copy, get_valid_moves):
+            results[f"micro/{operation.__name__}/{name}"] = measure(operation, repeats, rounds)
+        results[f"micro/heuristic_evaluation/{name}"] = measure(heuristic_evaluation, repeats // 10, rounds)
+    return results
+
+
+# empties the caches agents share across games in the process
+def clear_caches():
+    AStarAgent.evaluation_cache.clear()
+
+
+# playouts per second of every rollout policy, MCTS iterations per second from every benchmark position,
+# and full games per second for every agent pair
+def macro_benchmarks(scale, rounds, seed):
+    results = {}
+    playouts = 1000 * scale
+    iterations = 500 * scale
+    for name, moves in POSITIONS.items():
+        game = load_position(moves)
+        for policy_name, policy_type in ROLLOUT_POLICIES.items():
+            policy = policy_type()
+
+            def playout(n):
+                random.seed(seed)
+                for _ in range(n):
+                    policy.playout(game)
+
+            results[f"macro/playouts/{policy_name}/{name}"] = measure(playout, playouts, rounds)
+
+        def search(n):
+            random.seed(seed)
+            MonteCarloTreeSearch(game).run_search(n)
+
+        results[f"macro/mcts_iterations/{name}"] = measure(search, iterations, rounds)
+
+    games = 2 * scale
+    for name, (config1, config2) in GAME_PAIRS.items():
+        def play(n):
+            for game_index in range(n):
+                play_seeded_game(config1, config2, seed + game_index)
+
+        # every round starts from empty A* caches, so later rounds do not just replay cache hits
+        results[f"macro/games/{name}"] = measure(play, games, rounds, clear_caches)
+    return results
+
+
+# compares results with a baseline and returns the benchmarks that got slower by more than threshold
+# (all benchmarks are rates, so higher is better)
+def find_regressions(results, baseline, threshold):
+    regressions = []
+    for name, rate in results.items():
+        previous = baseline.get(name)
+        if previous and rate < previous * (1 - threshold):
+            regressions.append((name, previous, rate))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the Connect Four engine and agents.")
+    parser.add_argument("--output", help="writes the results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="slowdown relative to the baseline reported as a regression (default 0.10 = 10%%)")
+    parser.add_argument("--scale", type=int, default=1, help="multiplies the amount of work per benchmark")
+    parser.add_argument("--rounds", type=int, default=3, help="runs per benchmark, the best one is kept")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the searches and games")
+    parser.add_argument("--only", choices=("micro", "macro"), help="runs only one group of benchmarks")
+    args = parser.parse_args(argv)
+
+    results = {}
+    if args.only != "macro":
+        results.update(micro_benchmarks(args.scale, args.rounds))
+    if args.only != "micro":
+        results.update(macro_benchmarks(args.scale, args.rounds, args.seed))
+
+    for name, rate in results.items():
+        print(f"{name:45} {rate:14.1f} /s")
+
+    report = {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "scale": args.scale,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+        regressions = find_regressions(results, baseline, args.threshold)
+        for name, previous, rate in regressions:
+            print(f"REGRESSION {name}: {previous:.1f}/s -> {rate:.1f}/s ({rate / previous - 1:+.1%})")
+        if regressions:
+            return 1
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,103 +1,341 @@
+import random
+
+# dimensions of the standard board; other sizes and win lengths are described by a Geometry
+ROWS = 6
+COLUMNS = 7
+COLUMN_HEIGHT = ROWS + 1
+
+CONNECT = 4  # markers in a row needed to win
+
+
+# builds the line test of a geometry: four in a row is found by shifting the bitboard onto itself, for runs of
+# length connect the run is doubled until it covers at least half the line and then overlapped with itself
+def _line_test(shifts, connect):
+    steps = []
+    length = 1
+    while 2 * length < connect:
+        steps.append(length)
+        length *= 2
+    steps.append(connect - length)
+    plan = [[step * shift for step in steps] for shift in shifts]
+    if len(steps) == 2:
+        # connect 3 and 4: the two steps unrolled, which is the common case
+        plan = [tuple(offsets) for offsets in plan]
+
+        def has_line(mask):
+            for first, second in plan:
+                pairs = mask & (mask >> first)
+                if pairs & (pairs >> second):
+                    return True
+            return False
+    else:
+        def has_line(mask):
+            for offsets in plan:
+                run = mask
+                for offset in offsets:
+                    run &= run >> offset
+                if run:
+                    return True
+            return False
+    return has_line
+
+
+# builds the threat finder of a geometry: the empty cells that would complete a line, i.e. cells with k markers
+# of the player on one side and connect - 1 - k on the other along some direction
+def _threat_finder(column_height, connect, board_mask):
+    if connect == 4:
+        def winning_cells(player_mask, occupied):
+            # vertical: three stacked markers with room above
+            cells = (player_mask << 1) & (player_mask << 2) & (player_mask << 3)
+            for shift in (column_height, column_height - 1, column_height + 1):  # horizontal and both diagonals
+                pairs = (player_mask << shift) & (player_mask << 2 * shift)
+                cells |= pairs & (player_mask << 3 * shift)  # the cell right of three in a row
+                cells |= pairs & (player_mask >> shift)  # a gap with two markers on its left and one on its right
+                pairs = (player_mask >> shift) & (player_mask >> 2 * shift)
+                cells |= pairs & (player_mask >> 3 * shift)  # the cell left of three in a row
+                cells |= pairs & (player_mask << shift)  # a gap with two markers on its right and one on its left
+            return cells & (board_mask ^ occupied)
+        return winning_cells
+
+    def winning_cells(player_mask, occupied):
+        cells = player_mask << 1
+        for step in range(2, connect):
+            cells &= player_mask << step  # connect - 1 stacked markers below the cell
+        for shift in (column_height, column_height - 1, column_height + 1):
+            before = [-1]  # before[k]: cells with k markers right before them along the line
+            after = [-1]  # after[k]: cells with k markers right after them
+            for step in range(1, connect):
+                before.append(before[-1] & (player_mask << step * shift))
+                after.append(after[-1] & (player_mask >> step * shift))
+            for count in range(connect):
+                cells |= before[count] & after[connect - 1 - count]
+        return cells & (board_mask ^ occupied)
+    return winning_cells
+
+
+# board size and win length, with every table the engine and the agents derive from them: the bitboard masks,
+# the windows that can hold a winning line, the Zobrist keys and the line and threat tests.
+# the board is stored as two bitboards (one per player) with column_height = rows + 1 bits per column:
+# bit (column * column_height + row) is set when that player has a marker there, with row 0 at the bottom, and
+# the extra top bit of each column is an always-empty sentinel, so the shift-and-mask tests never wrap.
+# geometries are built once and shared by every game using them, see get_geometry
+class Geometry:
+    def __init__(self, rows=ROWS, columns=COLUMNS, connect=CONNECT):
+        if rows < 1 or columns < 1 or not 2 <= connect <= max(rows, columns):
+            raise ValueError(f"Cannot connect {connect} on a board of {rows} rows and {columns} columns")
+        self.rows = rows
+        self.columns = columns
+        self.connect = connect
+        self.column_height = rows + 1
+        self.cells = rows * columns  # number of playable cells, i.e. moves in a drawn game
+        self.bits = columns * self.column_height  # bitboard width, sentinel cells included
+
+        # one random 64-bit key per (player, cell) for the incrementally updated Zobrist hash of a position;
+        # a fixed seed keeps hashes identical across runs and processes
+        zobrist_random = random.Random(0x0C4F)
+        self.zobrist_keys = [[zobrist_random.getrandbits(64) for _ in range(self.bits)] for _ in range(2)]
+
+        self.bottom_mask = sum(1 << self.cell_index(col, 0) for col in range(columns))  # lowest cell of every column
+        self.board_mask = self.bottom_mask * ((1 << rows) - 1)  # every playable cell (no sentinel row)
+        # playable cells per column
+        self.column_masks = [((1 << rows) - 1) << self.cell_index(col, 0) for col in range(columns)]
+        # the board is left-right symmetric: a position and its horizontal mirror image have the same value, with
+        # every move mapped to the mirrored column. caches keyed on canonical keys (the smaller key of the two
+        # images) share their entries between mirrored positions
+        self.mirror_cells = [self.cell_index(columns - 1 - cell // self.column_height, cell % self.column_height)
+                             for cell in range(self.bits)]
+        self.centre_first = sorted(range(columns), key=lambda col: abs(2 * col - (columns - 1)))  # search order
+
+        self.windows = self._build_windows()
+        # for every cell, the windows that pass through it
+        self.cell_windows = [[window for window in self.windows if window >> cell & 1] for cell in range(self.bits)]
+        # vertical, horizontal and both diagonals
+        self.has_line = _line_test((1, self.column_height, self.column_height + 1, self.column_height - 1), connect)
+        self.winning_cells = _threat_finder(self.column_height, connect, self.board_mask)
+
+    def __repr__(self):
+        return f"Geometry(rows={self.rows}, columns={self.columns}, connect={self.connect})"
+
+    # pickles as its dimensions, so states sent to worker processes use that process's shared geometry
+    def __reduce__(self):
+        return get_geometry, (self.rows, self.columns, self.connect)
+
+    # bitboard index of the cell at a given column and row (row 0 at the bottom)
+    def cell_index(self, column, row):
+        return column * self.column_height + row
+
+    # precomputes the windows of connect cells that can hold a winning line, as bitboard masks
+    def _build_windows(self):
+        windows = []
+        length = self.connect - 1
+        for col in range(self.columns):
+            for row in range(self.rows):
+                for d_col, d_row in ((1, 0), (0, 1), (1, 1), (1, -1)):
+                    end_col, end_row = col + length * d_col, row + length * d_row
+                    if end_col < self.columns and 0 <= end_row < self.rows:
+                        windows.append(sum(1 << self.cell_index(col + i * d_col, row + i * d_row)
+                                           for i in range(self.connect)))
+        return windows
+
+    # cells where the next marker in each non-full column would land, given the mask of all occupied cells
+    def playable_cells(self, occupied):
+        return (occupied + self.bottom_mask) & self.board_mask
+
+    # column a move is played in on the mirrored board
+    def mirror_column(self, column):
+        return self.columns - 1 - column
+
+    # mirror image of a bitboard (or of a position key), moving every column to the mirrored column
+    def mirror_mask(self, mask):
+        height = self.column_height
+        column_bits = (1 << height) - 1
+        mirrored = 0
+        for col in range(self.columns):
+            mirrored |= (mask >> col * height & column_bits) << (self.columns - 1 - col) * height
+        return mirrored
+
+
+_geometries = {}  # (rows, columns, connect) -> Geometry
+
+
+# returns the shared geometry of a board size and win length, building its tables on first use
+def get_geometry(rows=ROWS, columns=COLUMNS, connect=CONNECT):
+    key = (rows, columns, connect)
+    geometry = _geometries.get(key)
+    if geometry is None:
+        geometry = _geometries[key] = Geometry(rows, columns, connect)
+    return geometry
+
+
+# the standard 6x7 connect-four board; the module-level names below are its tables, for code that only plays on it
+STANDARD = get_geometry()
+ZOBRIST_KEYS = STANDARD.zobrist_keys
+MIRROR_CELLS = STANDARD.mirror_cells
+WINDOWS = STANDARD.windows  # the 69 windows of four cells
+CELL_WINDOWS = STANDARD.cell_windows
+BOTTOM_MASK = STANDARD.bottom_mask
+BOARD_MASK = STANDARD.board_mask
+COLUMN_MASKS = STANDARD.column_masks
+cell_index = STANDARD.cell_index
+mirror_column = STANDARD.mirror_column
+mirror_mask = STANDARD.mirror_mask
+has_line = STANDARD.has_line
+playable_cells = STANDARD.playable_cells
+winning_cells = STANDARD.winning_cells
+
+
 class ConnectFour:
-    # initializes the game board, current player, and game status
-    def __init__(self, player1, player2):
-        self.board = self.initialize_board()
+    # initializes the game board, current player, and game status;
+    # the board size and win length default to the standard 6 rows, 7 columns and four in a row
+    def __init__(self, player1, player2, rows=ROWS, columns=COLUMNS, connect=CONNECT):
+        self.geometry = get_geometry(rows, columns, connect)  # shared tables for this board size and win length
+        self.masks = [0, 0]  # one bitboard per player, indexed like self.players
+        self.heights = [0] * columns  # number of markers in each column
+        self._board = None  # cached list-of-lists view of the board, rebuilt on demand
+        self.moves = []  # columns played so far, in order, so moves can be taken back
+        self.last_move = None  # column of the most recent move
+        self.move_count = 0  # number of markers on the board
+        self.winner = None  # marker of the player who completed a line, None while nobody has
+        self.hash = 0  # Zobrist hash of the position, updated on every make/unmake
+        self.mirror_hash = 0  # Zobrist hash of the position's mirror image, updated alongside
         self.players = [player1, player2]  # list of two players
         self.current_player_index = 0  # uses an index to toggle between players
         self.game_over = False  # checks if the game is ongoing/over
 
-    # creates a 6*7 game board filled with "-" to represent empty spaces
+    # creates a rows*columns game board filled with "-" to represent empty spaces
     def initialize_board(self):
-        return [["-" for _ in range(7)] for _ in range(6)]
+        return [["-" for _ in range(self.geometry.columns)] for _ in range(self.geometry.rows)]
+
+    # list-of-lists view of the bitboards (top row first), used for display and segment scoring
+    @property
+    def board(self):
+        if self._board is None:
+            board = self.initialize_board()
+            geometry = self.geometry
+            for index, mask in enumerate(self.masks):
+                marker = self.players[index].marker
+                for col in range(geometry.columns):
+                    for row in range(self.heights[col]):
+                        if mask >> geometry.cell_index(col, row) & 1:
+                            board[geometry.rows - 1 - row][col] = marker
+            self._board = board
+        return self._board
 
     # prints the current state of the board along with column numbers for player reference
     def display_board(self):
         print('\nGame Board\n')
+        width = len(str(self.geometry.columns))  # columns from 10 on take two characters
         for row in self.board:
-            print(' '.join(row))
-        print('\n1 2 3 4 5 6 7\n')
+            print(' '.join(cell.rjust(width) for cell in row))
+        print('\n' + ' '.join(str(col + 1).rjust(width) for col in range(self.geometry.columns)) + '\n')
+
+    # unique integer key of the position: the bitboard of the player to move plus the occupied cells
+    def position_key(self):
+        return self.masks[self.current_player_index] + (self.masks[0] | self.masks[1])
+
+    # position key shared by the position and its mirror image
+    def canonical_position_key(self):
+        key = self.position_key()
+        return min(key, self.geometry.mirror_mask(key))
+
+    # Zobrist hash shared by the position and its mirror image
+    def canonical_hash(self):
+        return min(self.hash, self.mirror_hash)
+
+    # True when the canonical hash is the one of the mirror image, so moves stored under it
+    # have to be mirrored (symmetric positions are never mirrored)
+    def is_mirrored(self):
+        return self.mirror_hash < self.hash
+
+    # returns the index in self.players of the player using the given marker
+    def player_index(self, marker):
+        return 0 if self.players[0].marker == marker else 1
 
     # checks if a move can be made in the given column
     def is_valid_move(self, column):
-        return self.board[0][column] == "-"
+        return 0 <= column < self.geometry.columns and self.heights[column] < self.geometry.rows
 
-    # updates the board with the current player's marker if the move is valid
+    # updates the board with the current player's marker if the move is valid,
+    # and records whether that move completed a line
     def make_move(self, column, marker):
         if self.is_valid_move(column):
-            for row in reversed(range(6)):
-                if self.board[row][column] == "-":
-                    self.board[row][column] = marker
-                    return True
+            geometry = self.geometry
+            index = self.player_index(marker)
+            cell = column * geometry.column_height + self.heights[column]
+            mask = self.masks[index] | 1 << cell
+            self.masks[index] = mask
+            keys = geometry.zobrist_keys[index]
+            self.hash ^= keys[cell]
+            self.mirror_hash ^= keys[geometry.mirror_cells[cell]]
+            self.heights[column] += 1
+            self.move_count += 1
+            self.moves.append(column)
+            self.last_move = column
+            self._board = None
+            # only the mover can have completed a line, and any new line has to pass through the new marker
+            if self.winner is None and geometry.has_line(mask):
+                self.winner = marker
+            return True
         return False
 
-    # checks for a win condition in all four directions (horizontal, vertical, ascending diagonal, descending diagonal)
-    def check_win(self, marker):
-        # horizontal
-        for row in range(6):
-            for col in range(4):
-                if self.board[row][col] == marker and \
-                        self.board[row][col + 1] == marker and \
-                        self.board[row][col + 2] == marker and \
-                        self.board[row][col + 3] == marker:
-                    return True
-
-        # vertical
-        for col in range(7):
-            for row in range(3):
-                if self.board[row][col] == marker and \
-                        self.board[row + 1][col] == marker and \
-                        self.board[row + 2][col] == marker and \
-                        self.board[row + 3][col] == marker:
-                    return True
+    # takes back the most recent move, which must have been played in the given column
+    def unmake_move(self, column):
+        if not self.moves or self.moves[-1] != column:
+            return False
+        self.moves.pop()
+        geometry = self.geometry
+        self.heights[column] -= 1
+        cell = column * geometry.column_height + self.heights[column]
+        index = 0 if self.masks[0] >> cell & 1 else 1
+        self.masks[index] ^= 1 << cell
+        keys = geometry.zobrist_keys[index]
+        self.hash ^= keys[cell]
+        self.mirror_hash ^= keys[geometry.mirror_cells[cell]]
+        self.move_count -= 1
+        self.last_move = self.moves[-1] if self.moves else None
+        self._board = None
+        self.winner = None  # a finished game can only be resumed by taking back the winning move
+        return True
 
-        # ascending diagonal (positive slope)
-        for col in range(7 - 3):
-            for row in range(3, 6):
-                if self.board[row][col] == marker and \
-                        self.board[row - 1][col + 1] == marker and \
-                        self.board[row - 2][col + 2] == marker and \
-                        self.board[row - 3][col + 3] == marker:
-                    return True
-
-        # descending diagonal (negative slope)
-        for col in range(7 - 3):
-            for row in range(3):
-                if self.board[row][col] == marker and \
-                        self.board[row + 1][col + 1] == marker and \
-                        self.board[row + 2][col + 2] == marker and \
-                        self.board[row + 3][col + 3] == marker:
-                    return True
-
-        return False
+    # checks for a win condition in all four directions (vertical, horizontal, ascending diagonal, descending diagonal)
+    # by shifting the player's bitboard onto itself, which tests every window at once
+    def check_win(self, marker):
+        return self.geometry.has_line(self.masks[self.player_index(marker)])
 
     # checks if the game is a draw
     def is_draw(self):
-        return all(self.board[0][col] != "-" for col in range(7))  # if no empty cells in the top row
+        return self.move_count == self.geometry.cells  # if every cell is filled
 
-    # creates a deep copy of the game state
+    # creates a copy of the game state
     def copy(self):
-        new_game = ConnectFour(self.players[0], self.players[1])
-        new_game.board = [row[:] for row in self.board]
+        new_game = ConnectFour.__new__(ConnectFour)
+        new_game.geometry = self.geometry
+        new_game.masks = self.masks[:]
+        new_game.heights = self.heights[:]
+        new_game._board = None
+        new_game.moves = self.moves[:]
+        new_game.last_move = self.last_move
+        new_game.move_count = self.move_count
+        new_game.winner = self.winner
+        new_game.hash = self.hash
+        new_game.mirror_hash = self.mirror_hash
+        new_game.players = self.players
         new_game.current_player_index = self.current_player_index
         new_game.game_over = self.game_over
         return new_game
 
     # returns a list of columns that can accept another marker
     def get_valid_moves(self):
-        return [c for c in range(7) if self.is_valid_move(c)]
+        rows = self.geometry.rows
+        return [c for c, height in enumerate(self.heights) if height < rows]
 
     # checks if there is a win or a draw
     def is_terminal(self):
-        return self.game_over or self.is_draw()
+        return self.game_over or self.winner is not None or self.move_count == self.geometry.cells
 
     # determines the result of the game
     def get_result(self):
-        if self.check_win(self.players[0].marker):
-            return self.players[0].marker
-        elif self.check_win(self.players[1].marker):
-            return self.players[1].marker
-        else:
-            return "draw"
+        return self.winner if self.winner is not None else "draw"
 
     # contains the game loop, handling turn taking, input validation, win/draw checking, and player switching
     def run_game(self):
@@ -0,0 +1,168 @@
+import mmap
+import os
+import struct
+from collections import namedtuple
+
+from connect_four_game import CONNECT, STANDARD, get_geometry
+
+RESULTS = ("X", "O", "draw")  # stored as their index
+RESULT_CODES = {result: code for code, result in enumerate(RESULTS)}
+NAME_RECORD = 0  # defines the agent name behind an index
+GAME_RECORD = 1  # one finished game
+# the two columns stored in every byte of a move sequence, the first move in the low nibble
+NIBBLE_PAIRS = [(byte & 0x0F, byte >> 4) for byte in range(256)]
+
+# one stored game; moves are the columns played, in order
+GameRecord = namedtuple("GameRecord", "player1 player2 result moves seed duration")
+
+
+# streaming file of finished games: a header followed by variable-size records
+# agent names are written once, as name records, and games refer to them by index; every game record holds
+# both name indexes, the result, the seed, the duration and the moves packed two per byte, so a 42-move game
+# takes 40 bytes and files with millions of games can be appended to and read back without replaying anything;
+# the header records the board geometry, and nibbles limit it to 16 columns
+HEADER = struct.Struct("<4sBBBB")  # magic, format version, rows, columns, win length (padding in version 1)
+NAME = struct.Struct("<BHH")  # record type, name index, length of the UTF-8 name that follows
+GAME = struct.Struct("<BHHBBQf")  # record type, player1 index, player2 index, result, moves, seed, seconds
+MAGIC = b"C4GR"
+VERSION = 2  # version 1 files lack the win length and hold connect-four games
+
+
+def pack_moves(moves):
+    packed = bytearray((len(moves) + 1) // 2)
+    for index, column in enumerate(moves):
+        packed[index >> 1] |= column << (4 * (index & 1))
+    return packed
+
+
+def unpack_moves(data, offset, count):
+    moves = []
+    for byte in data[offset:offset + (count + 1) // 2]:
+        moves.extend(NIBBLE_PAIRS[byte])
+    if count & 1:
+        moves.pop()  # the high nibble of the last byte is padding
+    return moves
+
+
+# buffered writer for game records; appends to an existing file, or creates it with a header
+class GameRecordWriter:
+    def __init__(self, path, buffer_size=1 << 16, geometry=STANDARD):
+        if geometry.columns > 16 or geometry.cells > 255:
+            raise ValueError(f"Game records hold at most 16 columns and 255 moves, not {geometry!r}")
+        self.names = {}  # agent name -> index
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with GameRecordReader(path) as reader:
+                if reader.geometry is not geometry:
+                    raise ValueError(f"{path} holds games on {reader.geometry!r}, not {geometry!r}")
+                reader.scan_names()
+                self.names = {name: index for index, name in enumerate(reader.names)}
+        self.file = open(path, "ab")
+        self.buffer = bytearray()
+        self.buffer_size = buffer_size  # buffered bytes written to the file at once
+        if self.file.tell() == 0:
+            self.buffer += HEADER.pack(MAGIC, VERSION, geometry.rows, geometry.columns, geometry.connect)
+        self.games = 0  # games written by this writer
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def name_index(self, name):
+        index = self.names.get(name)
+        if index is None:
+            index = self.names[name] = len(self.names)
+            encoded = name.encode()
+            self.buffer += NAME.pack(NAME_RECORD, index, len(encoded))
+            self.buffer += encoded
+        return index
+
+    def write(self, player1, player2, result, moves, seed=0, duration=0.0):
+        self.buffer += GAME.pack(GAME_RECORD, self.name_index(player1), self.name_index(player2),
+                                 RESULT_CODES[result], len(moves), seed, duration)
+        self.buffer += pack_moves(moves)
+        self.games += 1
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    # writes a game summary as returned by tournament.play_seeded_game
+    def write_summary(self, summary):
+        self.write(summary["player1"], summary["player2"], summary["result"], summary["moves"],
+                   summary["seed"], summary["duration"])
+
+    def flush(self):
+        self.file.write(self.buffer)
+        self.file.flush()
+        self.buffer.clear()
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+
+
+# memory-maps a game record file and iterates over its games in the order they were written
+class GameRecordReader:
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, rows, columns, connect = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version not in (1, VERSION):
+            raise ValueError(f"{path} is not a game record file in format version {VERSION}")
+        self.geometry = get_geometry(rows, columns, connect if version > 1 else CONNECT)  # board the games are on
+        self.names = []  # agent names by index, filled in as name records are read
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.file.close()
+            self.data = self.file = None
+
+    # reads every name record without decoding the games, e.g. to append to the file
+    def scan_names(self):
+        for _ in self.records(names_only=True):
+            pass
+
+    # walks the records, yielding game records as tuples of raw fields and the offset of their moves
+    def records(self, names_only=False):
+        data = self.data
+        offset = HEADER.size
+        end = len(data)
+        self.names.clear()
+        while offset < end:
+            if data[offset] == NAME_RECORD:
+                _, index, length = NAME.unpack_from(data, offset)
+                offset += NAME.size
+                self.names.append(data[offset:offset + length].decode())
+                offset += length
+            else:
+                fields = GAME.unpack_from(data, offset)
+                offset += GAME.size
+                if not names_only:
+                    yield fields, offset
+                offset += (fields[4] + 1) // 2
+
+    def __iter__(self):
+        names = self.names
+        for (_, player1, player2, result, count, seed, duration), offset in self.records():
+            yield GameRecord(names[player1], names[player2], RESULTS[result],
+                             unpack_moves(self.data, offset, count), seed, duration)
+
+
+# counts results after every opening of the given number of plies, e.g. {(3, 3): {"X": 10, "O": 4, "draw": 1}}
+def opening_statistics(records, plies=2):
+    statistics = {}
+    for record in records:
+        if len(record.moves) < plies:
+            continue
+        totals = statistics.setdefault(tuple(record.moves[:plies]), dict.fromkeys(RESULTS, 0))
+        totals[record.result] += 1
+    return statistics
@@ -0,0 +1,161 @@
+import json
+import time
+from functools import wraps
+
+from connect_four_game import ConnectFour
+
+# search methods timed by an instrumented MonteCarloTreeSearch, and the phase each one is reported under
+SEARCH_PHASES = {
+    "select_node": "select",
+    "expand_node": "expand",
+    "simulate": "simulate",
+    "simulate_batch": "simulate",
+    "simulate_recorded": "simulate",
+    "backpropagate": "backpropagate",
+    "backpropagate_counts": "backpropagate",
+    "unwind_amaf": "backpropagate",
+}
+# engine methods whose calls are counted while an attached agent is choosing a move
+COUNTED_CALLS = ("check_win", "copy", "make_move", "unmake_move", "get_valid_moves")
+
+
+# writes every move record as one JSON object per line
+class JsonLinesSink:
+    def __init__(self, path):
+        self.file = open(path, "a")
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+# opt-in per-move instrumentation for agents and searches
+# nothing is patched until an agent is attached, so agents and searches without a profiler run at full speed;
+# attached agents report per move: wall time, iterations, nodes created, playouts per second, tree depth,
+# time spent in each MCTS phase and the number of engine calls
+class Profiler:
+    def __init__(self, sink=None):
+        self.sink = sink  # object with a write(record) method, e.g. JsonLinesSink; None keeps records in memory only
+        self.records = []  # one dictionary per profiled move
+        self.current = None  # record of the move being profiled
+
+    # wraps an agent's make_move so every move it makes is recorded
+    def attach(self, agent):
+        agent.profiler = self  # searches created by the agent are instrumented too
+        make_move = agent.make_move
+
+        @wraps(make_move)
+        def profiled_make_move(game):
+            return self.profile_move(agent, game, make_move)
+
+        agent.make_move = profiled_make_move
+        return agent
+
+    # runs one move of an agent and records its statistics
+    def profile_move(self, agent, game, make_move):
+        record = {
+            "agent": type(agent).__name__,
+            "marker": agent.marker,
+            "move_number": game.move_count,
+            "phase_seconds": {phase: 0.0 for phase in dict.fromkeys(SEARCH_PHASES.values())},
+            "max_depth": 0,
+            "calls": {name: 0 for name in COUNTED_CALLS},
+        }
+        self.current = record
+        previous_search = getattr(agent, "search", None)
+        nodes_before = getattr(previous_search, "nodes_created", 0)
+        originals = {name: getattr(ConnectFour, name) for name in COUNTED_CALLS}
+        for name, method in originals.items():
+            setattr(ConnectFour, name, self._counted(method, record["calls"], name))
+        start_time = time.perf_counter()
+        try:
+            move = make_move(game)
+        finally:
+            duration = time.perf_counter() - start_time
+            for name, method in originals.items():
+                setattr(ConnectFour, name, method)
+            self.current = None
+
+        record["move"] = move
+        record["seconds"] = duration
+        # the expansion runs inside the selection, so its time is only reported once
+        record["phase_seconds"]["select"] -= record["phase_seconds"]["expand"]
+        search = getattr(agent, "search", None)
+        if search is not None:
+            iterations = search.iterations_completed
+            record["iterations"] = iterations
+            if hasattr(search, "nodes_created"):
+                # a reused tree keeps counting from the previous move
+                record["nodes_created"] = search.nodes_created - (nodes_before if search is previous_search else 0)
+            playouts = iterations * getattr(search, "playouts_per_leaf", 1)
+            record["playouts"] = playouts
+            record["playouts_per_second"] = playouts / duration if duration > 0 else None
+        if hasattr(agent, "nodes"):
+            record["nodes"] = agent.nodes  # positions visited by tree searches such as NegamaxAgent
+        self.records.append(record)
+        if self.sink is not None:
+            self.sink.write(record)
+        return move
+
+    @staticmethod
+    def _counted(method, calls, name):
+        @wraps(method)
+        def counted(*args, **kwargs):
+            calls[name] += 1
+            return method(*args, **kwargs)
+        return counted
+
+    # replaces the phase methods of one search instance with timed versions
+    def instrument(self, search):
+        for method_name, phase in SEARCH_PHASES.items():
+            setattr(search, method_name, self._timed(getattr(search, method_name), phase, method_name))
+
+    def _timed(self, method, phase, method_name):
+        @wraps(method)
+        def timed(*args, **kwargs):
+            start_time = time.perf_counter()
+            result = method(*args, **kwargs)
+            record = self.current
+            if record is not None:
+                record["phase_seconds"][phase] += time.perf_counter() - start_time
+                if method_name == "select_node":
+                    record["max_depth"] = max(record["max_depth"], len(result) - 1)
+            return result
+        return timed
+
+    # formats the recorded moves as a table, averaged per agent
+    def summary_table(self):
+        totals = {}
+        for record in self.records:
+            key = (record["agent"], record["marker"])
+            total = totals.setdefault(key, {"moves": 0, "seconds": 0.0, "iterations": 0, "playouts": 0,
+                                            "max_depth": 0, "phases": dict.fromkeys(record["phase_seconds"], 0.0),
+                                            "calls": dict.fromkeys(COUNTED_CALLS, 0)})
+            total["moves"] += 1
+            total["seconds"] += record["seconds"]
+            total["iterations"] += record.get("iterations") or 0
+            total["playouts"] += record.get("playouts") or 0
+            total["max_depth"] = max(total["max_depth"], record["max_depth"])
+            for phase, seconds in record["phase_seconds"].items():
+                total["phases"][phase] += seconds
+            for name, count in record["calls"].items():
+                total["calls"][name] += count
+
+        phases = list(dict.fromkeys(SEARCH_PHASES.values()))
+        header = (["agent", "moves", "ms/move", "iter/move", "playouts/s", "depth"]
+                  + [f"{phase} %" for phase in phases] + [f"{name}/move" for name in COUNTED_CALLS])
+        rows = [header]
+        for (agent, marker), total in totals.items():
+            moves = total["moves"]
+            seconds = total["seconds"]
+            row = [f"{agent} ({marker})", str(moves), f"{1000 * seconds / moves:.2f}",
+                   f"{total['iterations'] / moves:.0f}",
+                   f"{total['playouts'] / seconds:.0f}" if seconds > 0 else "-", str(total["max_depth"])]
+            row += [f"{100 * total['phases'][phase] / seconds:.1f}" if seconds > 0 else "-" for phase in phases]
+            row += [f"{total['calls'][name] / moves:.0f}" for name in COUNTED_CALLS]
+            rows.append(row)
+        widths = [max(len(row[column]) for row in rows) for column in range(len(header))]
+        return "\n".join("  ".join(cell.rjust(width) for cell, width in zip(row, widths)) for row in rows)
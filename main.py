@@ -1,5 +1,6 @@
 from connect_four_game import ConnectFour
-from player import HumanPlayer, RandomAIAgent, AStarAgent, MCTSAgent
+from player import HumanPlayer, RandomAIAgent, AStarAgent, MCTSAgent, NegamaxAgent
+from tournament import simulate_games
 
 
 # displays options for player type selection
@@ -18,7 +19,8 @@ def get_player_type(player_number):
                 print("1. Random AI Agent")
                 print("2. A* Agent")
                 print("3. MCTS Agent")
-                ai_type_selection = input("Enter your choice (1/2/3): ").strip()
+                print("4. Negamax Agent")
+                ai_type_selection = input("Enter your choice (1/2/3/4): ").strip()
 
                 if ai_type_selection == "1":
                     return RandomAIAgent("X" if player_number == 1 else "O")
@@ -26,6 +28,8 @@ def get_player_type(player_number):
                     return AStarAgent("X" if player_number == 1 else "O")
                 elif ai_type_selection == "3":
                     return MCTSAgent("X" if player_number == 1 else "O")
+                elif ai_type_selection == "4":
+                    return NegamaxAgent("X" if player_number == 1 else "O")
                 else:
                     print("Invalid selection, defaulting to Random AI Agent.")
                     return RandomAIAgent("X" if player_number == 1 else "O")  # ensures a default AI agent
@@ -41,7 +45,8 @@ def get_agent_type():
     print("1. Random AI Agent")
     print("2. A* Agent")
     print("3. MCTS Agent")
-    selection = input("Enter your choice (1/2/3): ").strip()
+    print("4. Negamax Agent")
+    selection = input("Enter your choice (1/2/3/4): ").strip()
 
     if selection == "1":
         return RandomAIAgent
@@ -49,41 +54,13 @@ def get_agent_type():
         return AStarAgent
     elif selection == "3":
         return MCTSAgent
+    elif selection == "4":
+        return NegamaxAgent
     else:
         print("Invalid selection, defaulting to Random AI Player.")
         return RandomAIAgent  # ensures a default is returned
 
 
-# simulates a given number of games between two player types, tracking wins and draws
-def simulate_games(num_games, player1_type, player2_type):
-    wins_for_X = 0
-    wins_for_O = 0
-    draws = 0
-
-    for _ in range(num_games):
-        player1 = player1_type('X')
-        player2 = player2_type('O')
-        game = ConnectFour(player1, player2)
-
-        while not game.game_over:
-            current_player = game.players[game.current_player_index]
-            column_choice = current_player.make_move(game)
-
-            if game.make_move(column_choice, current_player.marker):
-                if game.check_win(current_player.marker):
-                    if current_player.marker == 'X':
-                        wins_for_X += 1
-                    else:
-                        wins_for_O += 1
-                    game.game_over = True
-                elif game.is_draw():
-                    draws += 1
-                    game.game_over = True
-            game.current_player_index = (game.current_player_index + 1) % 2
-
-    return wins_for_X, wins_for_O, draws
-
-
 def main():
     print("Select mode:")
     print("1. AI vs. AI simulation (multiple games, no move display)")
@@ -98,7 +75,7 @@ def main():
         player1_type = get_agent_type()
         player2_type = get_agent_type()
 
-        wins_for_X, wins_for_O, draws = simulate_games(num_games, player1_type, player2_type)
+        wins_for_X, wins_for_O, draws, _ = simulate_games(num_games, player1_type, player2_type)
 
         print(f"\nSimulation Results:")
         print(f"Total games: {num_games}")
@@ -1,18 +1,38 @@
+import gc
 import math
-import random
+import time
+from collections import OrderedDict
+
+import batch_playout
+from rollout import get_rollout_policy
 
 
 # represents a node in the Monte Carlo Tree Search (MCTS) algorithm
+# nodes only keep the move that leads to them; the search rebuilds the position along the selection path.
+# __slots__ and bytearray move lists keep each node small, so large searches fit in memory
 class MCTSNode:
-    def __init__(self, game_state, parent=None, move=None, exploration_constant=1.41):
-        self.game_state = game_state.copy()  # duplicate of the game state to avoid altering the original game state
-        self.parent = parent  # the parent node of the current node, None if root
-        self.move = move  # the move that led to the creation of this node from the parent
+    __slots__ = ("move", "children", "child_moves", "wins", "visits", "unexplored_moves", "mirrored", "amaf_wins",
+                 "amaf_visits")
+
+    exploration_constant = 1.41  # default balance of exploration/exploitation, the search passes its own
+
+    def __init__(self, move=None, unexplored_moves=(), mirrored=False):
+        self.move = move  # the move that led to the creation of this node from the parent, None if root
         self.children = []  # child nodes of this node
+        # move leading to each child; differs from child.move when a transposition is shared
+        self.child_moves = bytearray()
         self.wins = 0  # number of wins recorded from this node
         self.visits = 0  # number of times this node has been visited during search
-        self.unexplored_moves = game_state.get_valid_moves()  # moves not yet explored from this node
-        self.exploration_constant = exploration_constant  # balances exploration/exploitation
+        # moves not yet explored from this node (empty for terminal positions)
+        self.unexplored_moves = bytearray(unexplored_moves)
+        # orientation of the position the node was created for (see ConnectFour.is_mirrored); the moves stored
+        # in the node are mirrored when it is reached through the other orientation of the same position
+        self.mirrored = mirrored
+        # all-moves-as-first statistics per column (in the node's orientation), for searches using RAVE: playouts
+        # through this node in which its player to move later took the cell that column's move fills here, and
+        # the wins among them; None until the first update
+        self.amaf_wins = None
+        self.amaf_visits = None
 
     def uct_score(self, total_simulations, exploration_constant=None):
         # calculates the Upper Confidence Bound 1 applied to trees (UCT) score
@@ -26,85 +46,409 @@ class MCTSNode:
         # checks if all possible moves have been explored from this node
         return len(self.unexplored_moves) == 0
 
-    def is_terminal(self):
-        # checks if this node represents a terminal state of the game
-        return self.game_state.is_terminal()
+    def best_edge(self, exploration_constant=None):
+        # selects the best child node based on the UCT score, returning it with the move that leads to it;
+        # the score is computed inline over the children, with the logarithm of the node's own visit count
+        # taken once per call
+        if exploration_constant is None:
+            exploration_constant = self.exploration_constant
+        children = self.children
+        log_total = math.log(self.visits) if self.visits else 0.0
+        best_index = 0
+        best_score = float('-inf')
+        for index, child in enumerate(children):
+            visits = child.visits
+            if visits == 0:
+                best_index = index  # unvisited children are tried first
+                break
+            score = child.wins / visits + exploration_constant * (log_total / visits) ** 0.5
+            if score > best_score:
+                best_index, best_score = index, score
+        return self.child_moves[best_index], children[best_index]
+
+    def rave_edge(self, exploration_constant, equivalence):
+        # like best_edge, with each child's win rate blended with the AMAF win rate of its move; the AMAF weight
+        # starts at 1 and fades as the child gets visits, to about one half after equivalence / 3 of them
+        children = self.children
+        child_moves = self.child_moves
+        amaf_wins, amaf_visits = self.amaf_wins, self.amaf_visits
+        log_total = math.log(self.visits) if self.visits else 0.0
+        best_index = 0
+        best_score = float('-inf')
+        for index, child in enumerate(children):
+            visits = child.visits
+            if visits == 0:
+                best_index = index  # unvisited children are tried first
+                break
+            value = child.wins / visits
+            if amaf_visits is not None:
+                column = child_moves[index]
+                if amaf_visits[column]:
+                    beta = (equivalence / (3 * visits + equivalence)) ** 0.5
+                    value += beta * (amaf_wins[column] / amaf_visits[column] - value)
+            score = value + exploration_constant * (log_total / visits) ** 0.5
+            if score > best_score:
+                best_index, best_score = index, score
+        return child_moves[best_index], children[best_index]
 
     def best_child(self, exploration_constant=None):
         # selects the best child node based on the UCT score
-        if exploration_constant is None:
-            exploration_constant = self.exploration_constant
-        total_simulations = sum(child.visits for child in self.children)
-        return max(
-            self.children,
-            key=lambda child: child.uct_score(total_simulations, exploration_constant)
-        )
+        return self.best_edge(exploration_constant)[1]
+
+
+# bounded table mapping position hashes to search nodes, so transpositions share their statistics
+# the least recently used entry is evicted when the table is full; evicted nodes stay in the tree
+# but are no longer shared with new paths
+class TranspositionTable:
+    def __init__(self, capacity):
+        self.capacity = capacity  # maximum number of positions kept in the table
+        self.entries = OrderedDict()  # position hash -> node, ordered from least to most recently used
+        self.lookups = 0  # number of get() calls
+        self.hits = 0  # number of get() calls that found a node
+        self.evictions = 0  # number of entries dropped to stay within capacity
+
+    def get(self, position_hash):
+        # returns the node stored for a position, or None
+        self.lookups += 1
+        node = self.entries.get(position_hash)
+        if node is not None:
+            self.hits += 1
+            self.entries.move_to_end(position_hash)
+        return node
+
+    def put(self, position_hash, node):
+        # stores a node for a position, evicting the least recently used entry if needed
+        self.entries[position_hash] = node
+        self.entries.move_to_end(position_hash)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def hit_rate(self):
+        # fraction of lookups that found a shared node
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def stats(self):
+        # summary of table usage, for reporting
+        return {
+            "size": len(self.entries),
+            "capacity": self.capacity,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hit_rate(),
+            "evictions": self.evictions,
+        }
 
 
 # MCTS algorithm implementation
+# a single copy of the game state is walked down the tree and back up on every iteration,
+# using make_move/unmake_move instead of allocating a new board per node.
+# with a transposition table the tree becomes a DAG: a position reached through different move orders
+# is a single node, and backpropagation follows the selection path rather than parent links.
+# the table is keyed on canonical hashes, so a position and its mirror image also share one node.
+# optional refinements: RAVE blends every child's statistics with all-moves-as-first statistics gathered from
+# the moves of each playout, progressive widening grows each node's children with its visit count, and virtual
+# losses keep selections whose results are still pending (see BatchedSearch) from all picking the same leaf
 class MonteCarloTreeSearch:
-    def __init__(self, root):
-        self.root = root  # initializes the root of the Monte Carlo Tree Search
+    def __init__(self, game_state, exploration_constant=1.41, transposition_table_size=None, playouts_per_leaf=1,
+                 profiler=None, rollout_policy="random", rave_equivalence=0, widening_exponent=None):
+        self.state = game_state.copy()  # the one mutable board shared by every iteration
+        self.root_player_index = self.state.current_player_index  # player to move at the root
+        self.exploration_constant = exploration_constant
+        # optional table of shared nodes, None for a plain tree search
+        self.transpositions = TranspositionTable(transposition_table_size) if transposition_table_size else None
+        # playouts run for every selected leaf; large batches use the vectorised batch playout engine
+        self.playouts_per_leaf = playouts_per_leaf
+        # plays the simulations: a name from rollout.ROLLOUT_POLICIES or a policy object
+        self.rollout_policy = get_rollout_policy(rollout_policy)
+        # visits after which a child's own win rate and its AMAF win rate weigh about the same; 0 disables RAVE
+        self.rave_equivalence = rave_equivalence
+        # with progressive widening, a node with n visits has at most n ** widening_exponent + 1 children, the
+        # most promising moves first; None expands every move before any child is revisited
+        self.widening_exponent = widening_exponent
+        self.nodes_created = 0  # number of nodes allocated by this search
+        self.root = self.create_node()  # initializes the root of the Monte Carlo Tree Search
+        self.iterations_completed = 0  # number of iterations run by the last run_search call
+        if profiler is not None:
+            profiler.instrument(self)  # times the search phases; without a profiler the methods are left untouched
+        if self.transpositions is not None:
+            self.transpositions.put(self.state.canonical_hash(), self.root)
+
+    def create_node(self, move=None):
+        # creates a node for the current position of the search state
+        unexplored_moves = [] if self.state.is_terminal() else self.state.get_valid_moves()
+        self.nodes_created += 1
+        return MCTSNode(move, unexplored_moves, self.state.is_mirrored())
+
+    def node_move(self, node, move):
+        # maps a move stored in a node to the column to play in the search state, and back:
+        # a node shared through the transposition table may have been created for the mirror image
+        return self.state.geometry.mirror_column(move) if node.mirrored != self.state.is_mirrored() else move
+
+    def play(self, move):
+        # plays a move for the player to move and hands the turn over
+        state = self.state
+        state.make_move(move, state.players[state.current_player_index].marker)
+        state.current_player_index = (state.current_player_index + 1) % 2
+
+    def undo(self, move):
+        # takes back a move made with play()
+        state = self.state
+        state.current_player_index = (state.current_player_index + 1) % 2
+        state.unmake_move(move)
+
+    def advance(self, move):
+        # promotes the child reached by the given move to be the new root, keeping its statistics;
+        # returns False when that move has not been explored yet
+        stored_move = self.node_move(self.root, move)
+        if stored_move not in self.root.child_moves:
+            return False
+        self.root = self.root.children[self.root.child_moves.index(stored_move)]
+        self.play(move)
+        self.root_player_index = self.state.current_player_index
+        return True
 
     def select_node(self):
-        # selects the node to explore based on the current state of the MCTS tree
+        # selects the node to explore and returns the path to it from the root,
+        # leaving the search state at the position of the last node
         current_node = self.root
-        while not current_node.is_terminal():  # continues until a terminal node is reached
-            if not current_node.is_fully_expanded():
-                # expands the current node if it has unexplored children
-                return self.expand_node(current_node)
+        path = [current_node]
+        widening = self.widening_exponent
+        while not self.state.is_terminal():  # continues until a terminal node is reached
+            if not current_node.is_fully_expanded() and (
+                    widening is None or len(current_node.children) <= current_node.visits ** widening):
+                # expands the current node if it has unexplored children (and, when widening, room for another)
+                path.append(self.expand_node(current_node))
+                return path
             else:
                 # otherwise, selects the best child based on UCT score
-                current_node = current_node.best_child()
-        return current_node  # returns the terminal or fully expanded node
+                if self.rave_equivalence:
+                    move, child = current_node.rave_edge(self.exploration_constant, self.rave_equivalence)
+                else:
+                    move, child = current_node.best_edge(self.exploration_constant)
+                if self.transpositions is not None:
+                    move = self.node_move(current_node, move)
+                current_node = child
+                self.play(move)
+                path.append(current_node)
+        return path  # returns the path to the terminal node
 
     def expand_node(self, node):
         # expands a node by creating a new child node from an unexplored move
-        move = node.unexplored_moves.pop()  # removes and retrieves the last unexplored move
-        new_state = node.game_state.copy()  # creates a copy of the current game state
-        # attempts to apply the move to the new game state
-        success = new_state.make_move(move, new_state.players[new_state.current_player_index].marker)
-
-        if success:
-            # updates the player index and checks for a win or draw if the move is successful
-            new_state.current_player_index = (new_state.current_player_index + 1) % 2
-            new_state.game_over = new_state.check_win(new_state.players[0].marker) or new_state.check_win(
-                new_state.players[1].marker) or new_state.is_draw()
-            child_node = MCTSNode(new_state, parent=node, move=move)  # creates a new child node
-            node.children.append(child_node)  # adds the new child node to the current node's children
-            return child_node
+        stored_move = self.next_unexplored_move(node)  # removes and retrieves the move to explore
+        move = self.node_move(node, stored_move)
+        self.play(move)  # make_move records any win or draw
+        child_node = None
+        if self.transpositions is not None:
+            # reuses the node of a transposition (or of its mirror image), which already carries statistics
+            child_node = self.transpositions.get(self.state.canonical_hash())
+        if child_node is None:
+            child_node = self.create_node(move)  # creates a new child node
+            if self.transpositions is not None:
+                self.transpositions.put(self.state.canonical_hash(), child_node)
+        node.children.append(child_node)  # adds the new child node to the current node's children
+        node.child_moves.append(stored_move)
+        return child_node
+
+    def next_unexplored_move(self, node):
+        # takes the last unexplored move of a node, or with progressive widening (where some moves may never be
+        # expanded) the most promising one: the best AMAF win rate once the node has those statistics,
+        # central columns first before that
+        moves = node.unexplored_moves
+        if self.widening_exponent is None or len(moves) == 1:
+            return moves.pop()
+        if node.amaf_visits is None:
+            centre = self.state.geometry.columns - 1
+            index = min(range(len(moves)), key=lambda i: abs(2 * moves[i] - centre))
         else:
-            return None  # returns None if the move was not successful
-
-    def simulate(self, node):
-        # simulates a game from the current node to a terminal state
-        simulation_state = node.game_state.copy()  # copies the game state for the simulation
-        while not simulation_state.is_terminal():
-            # continues simulation until a terminal state is reached
-            possible_moves = simulation_state.get_valid_moves()  # gets all valid moves for the current state
-            move = random.choice(possible_moves)  # randomly selects one of the valid moves
-            simulation_state.make_move(move, simulation_state.players[simulation_state.current_player_index].marker)
-            simulation_state.current_player_index = (simulation_state.current_player_index + 1) % 2  # switches players
-        return simulation_state.get_result()  # returns the result of the simulation
-
-    def backpropagate(self, node, result):
-        # backpropagates the simulation result through the tree, updating node statistics
-        while node is not None:  # continues until the root node is reached
+            amaf_wins, amaf_visits = node.amaf_wins, node.amaf_visits
+            index = max(range(len(moves)), key=lambda i: (amaf_wins[moves[i]] + 1) / (amaf_visits[moves[i]] + 2))
+        return moves.pop(index)
+
+    def simulate(self, position=None):
+        # simulates a game from the current search state (or the given position) to a terminal state with the
+        # rollout policy, which plays on copies of the bitboards and leaves the position untouched
+        return self.rollout_policy.playout(self.state if position is None else position)  # returns the result
+
+    def simulate_recorded(self):
+        # simulates like simulate, also returning the columns the playout played, for the AMAF statistics
+        moves = []
+        return self.rollout_policy.playout(self.state, moves), moves
+
+    def backpropagate(self, path, result):
+        # backpropagates the simulation result along the selection path, updating node statistics
+        players = self.state.players
+        for depth, node in enumerate(path):
             node.visits += 1  # increments the visit count for the node
-            if node.move is not None:  # checks if the node is not the root (the root node does not have a move)
-                last_move_player_marker = node.game_state.players[
-                    (node.game_state.current_player_index + 1) % 2].marker
-                if result == last_move_player_marker:  # increments the win count if the result matches the last move marker
+            if depth > 0:  # the root node does not have a move
+                # the move into the node at this depth was made by the root player on odd depths
+                last_move_player_marker = players[(self.root_player_index + depth - 1) % 2].marker
+                if result == last_move_player_marker:  # increments the win count if the result matches
                     node.wins += 1
-            node = node.parent  # moves to the parent node
-
-    def run_search(self, iterations):
-        # runs the MCTS algorithm for a specified number of iterations
-        for _ in range(iterations):
-            selected_node = self.select_node()  # selects a node for exploration
-            result = self.simulate(selected_node)  # simulates a playthrough from the selected node
-            self.backpropagate(selected_node, result)  # backpropagates the result through the tree
-
-        # selects the best move to make from the root node, using an exploration constant of 0 for exploitation
-        best_move = self.root.best_child(exploration_constant=0).move
-        return best_move  # returns the best move found
+
+    def simulate_many(self, playouts, position=None):
+        # runs several playouts from the current search state (or the given position) and counts their results
+        # ("draw" for draws); calls the policy directly, as simulate_batch (which may call this) is already timed
+        # as the simulate phase
+        playout = self.rollout_policy.playout
+        state = self.state if position is None else position
+        counts = {}
+        for _ in range(playouts):
+            result = playout(state)
+            counts[result] = counts.get(result, 0) + 1
+        return counts
+
+    def simulate_batch(self):
+        # runs playouts_per_leaf playouts from the current search state, with the vectorised batch engine when
+        # numpy is available, the batch is large enough to pay off, the rollout policy is the one it implements
+        # and the board fits its 64-bit arrays
+        if (batch_playout.np is None or self.playouts_per_leaf < batch_playout.MIN_PLAYOUTS or
+                not self.rollout_policy.batchable or not batch_playout.fits(self.state.geometry)):
+            return self.simulate_many(self.playouts_per_leaf)
+        return batch_playout.run_playouts([self.state], self.playouts_per_leaf)[0]
+
+    def backpropagate_counts(self, path, counts):
+        # backpropagates a batch of playout results, given as counts per result, in a single pass
+        players = self.state.players
+        total = sum(counts.values())
+        for depth, node in enumerate(path):
+            node.visits += total
+            if depth > 0:
+                last_move_player_marker = players[(self.root_player_index + depth - 1) % 2].marker
+                node.wins += counts.get(last_move_player_marker, 0)
+
+    def unwind(self, path):
+        # walks the search state back up from the end of the path to the root
+        for _ in range(len(path) - 1):
+            self.undo(self.state.last_move)
+
+    def unwind_amaf(self, path, playouts):
+        # walks the search state back up to the root like unwind, crediting every node on the path with the moves
+        # its player to move made after it, in the tree and in each (result, moves) playout, as if played first.
+        # a move counts for a column only if it filled the cell that column's move would fill at the node
+        state = self.state
+        players = state.players
+        geometry = state.geometry
+        columns, column_height = geometry.columns, geometry.column_height
+        # the result and final bitboards of every playout, with the tree moves already in the leaf's bitboards
+        played = []
+        for result, moves in playouts:
+            masks = state.masks[:]
+            heights = state.heights[:]
+            index = state.current_player_index
+            for column in moves:
+                masks[index] |= 1 << (column * column_height + heights[column])
+                heights[column] += 1
+                index ^= 1
+            played.append((result, masks))
+        for depth in range(len(path) - 1, -1, -1):
+            node = path[depth]
+            if node.amaf_visits is None:
+                node.amaf_wins = [0] * columns
+                node.amaf_visits = [0] * columns
+            amaf_wins, amaf_visits = node.amaf_wins, node.amaf_visits
+            mirrored = node.mirrored != state.is_mirrored()
+            mover = state.current_player_index
+            marker = players[mover].marker
+            playable = geometry.playable_cells(state.masks[0] | state.masks[1])
+            for result, masks in played:
+                won = result == marker
+                cells = masks[mover] & playable
+                while cells:
+                    column = ((cells & -cells).bit_length() - 1) // column_height
+                    cells &= cells - 1
+                    if mirrored:
+                        column = columns - 1 - column
+                    amaf_visits[column] += 1
+                    if won:
+                        amaf_wins[column] += 1
+            if depth:
+                self.undo(state.last_move)
+
+    def add_virtual_loss(self, path, amount=1):
+        # counts amount extra lost playouts on every node of a selected path until remove_virtual_loss, so that
+        # further selections made before its result comes back lean towards other leaves
+        for node in path:
+            node.visits += amount
+
+    def remove_virtual_loss(self, path, amount=1):
+        for node in path:
+            node.visits -= amount
+
+    def iterate(self):
+        # runs a single MCTS iteration; the search can be stopped and queried between any two calls
+        path = self.select_node()  # selects a node for exploration
+        if self.rave_equivalence:
+            # the playouts are run one by one, as the AMAF statistics need the moves each of them played
+            playouts = [self.simulate_recorded() for _ in range(self.playouts_per_leaf)]
+            counts = {}
+            for result, _ in playouts:
+                counts[result] = counts.get(result, 0) + 1
+            self.backpropagate_counts(path, counts)
+            self.unwind_amaf(path, playouts)
+            return
+        if self.playouts_per_leaf > 1:
+            # plays the whole batch of playouts for the leaf at once and applies their counts in one pass
+            counts = self.simulate_batch()
+            self.backpropagate_counts(path, counts)
+        else:
+            result = self.simulate()  # simulates a playthrough from the selected node
+            self.backpropagate(path, result)  # backpropagates the result through the tree
+        self.unwind(path)  # returns the search state to the root position
+
+    def best_move(self):
+        # returns the best move found so far, using an exploration constant of 0 for exploitation
+        if not self.root.children:
+            return self.node_move(self.root, self.root.unexplored_moves[-1]) if self.root.unexplored_moves else None
+        return self.node_move(self.root, self.root.best_edge(exploration_constant=0)[0])
+
+    def is_decided(self, remaining):
+        # checks if the leading root child can still be overtaken within the remaining number of iterations,
+        # assuming the worst case: every remaining playout is a loss for the leader and a win for a rival
+        remaining *= self.playouts_per_leaf
+        if self.root.unexplored_moves:
+            return False
+        if len(self.root.children) == 1:
+            return True
+        leader = self.root.best_child(exploration_constant=0)
+        worst_leader_rate = leader.wins / (leader.visits + remaining)
+        for child in self.root.children:
+            if child is not leader and (child.wins + remaining) / (child.visits + remaining) >= worst_leader_rate:
+                return False
+        return True
+
+    def run_search(self, iterations=None, time_limit=None, early_stop=False, check_interval=16):
+        # runs the MCTS algorithm for a number of iterations and/or a wall-clock time limit in seconds,
+        # stopping early when early_stop is set and the best move can no longer change
+        if iterations is None and time_limit is None:
+            raise ValueError("run_search needs an iteration count, a time limit or both")
+        # nodes never reference their parents, so reference counting frees them and the cyclic garbage collector
+        # only adds pauses that grow with the tree; it is paused for the duration of the search
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self._run_search(iterations, time_limit, early_stop, check_interval)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def _run_search(self, iterations, time_limit, early_stop, check_interval):
+        start_time = time.perf_counter()
+        deadline = start_time + time_limit if time_limit is not None else None
+        completed = 0
+        while iterations is None or completed < iterations:
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            self.iterate()
+            completed += 1
+            if early_stop and completed % check_interval == 0:
+                remaining = iterations - completed if iterations is not None else float('inf')
+                if deadline is not None:
+                    # estimates how many more iterations fit in the time that is left
+                    rate = completed / max(time.perf_counter() - start_time, 1e-9)
+                    remaining = min(remaining, rate * max(deadline - time.perf_counter(), 0.0))
+                if self.is_decided(remaining):
+                    break
+        self.iterations_completed = completed  # number of iterations run by the last call, for reporting
+
+        return self.best_move()  # returns the best move found
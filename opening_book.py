@@ -0,0 +1,281 @@
+import argparse
+import mmap
+import struct
+
+from connect_four_game import STANDARD, get_geometry
+
+
+# raised when the solver reaches its node budget before proving the result
+class SolverBudgetExceeded(Exception):
+    pass
+
+
+# exact Connect Four solver: negamax with alpha-beta pruning and null-window searches on the raw bitboards
+# scores are from the point of view of the player to move: positive for a forced win (larger when it comes sooner),
+# negative for a forced loss and 0 for a draw
+class Solver:
+    def __init__(self, max_nodes=None, table_size=1000000):
+        self.max_nodes = max_nodes  # positions visited per solve before giving up, None for no limit
+        self.table_size = table_size  # the table is cleared when it grows beyond this many positions
+        self.table = {}  # position key -> upper bound of its score, kept between solves
+        self.nodes = 0  # positions visited by the last solve
+        self.geometry = STANDARD  # board size and win length of the positions in the table
+
+    # prepares a solve of the game's position, starting a fresh table when the board geometry changes
+    def start(self, game):
+        self.nodes = 0
+        if game.geometry is not self.geometry:
+            self.geometry = game.geometry
+            self.table.clear()
+
+    # returns the exact score of a position for the player to move
+    def solve(self, game):
+        self.start(game)
+        return self._solve(game.masks[game.current_player_index], game.masks[0] | game.masks[1], game.move_count)
+
+    # returns the best move of a position with its exact score, or None if the game is already over;
+    # ties are broken towards the centre
+    def best_move(self, game):
+        if game.is_terminal():
+            return None
+        self.start(game)
+        geometry = self.geometry
+        cells = geometry.cells
+        current = game.masks[game.current_player_index]
+        occupied = game.masks[0] | game.masks[1]
+        moves = game.move_count
+        playable = geometry.playable_cells(occupied)
+        winning = geometry.winning_cells(current, occupied) & playable
+        best = None
+        for col in geometry.centre_first:
+            move = playable & geometry.column_masks[col]
+            if not move:
+                continue
+            if move & winning:
+                return col, (cells + 1 - moves) // 2
+            score = -self._solve(current ^ occupied, occupied | move, moves + 1)
+            if best is None or score > best[1]:
+                best = (col, score)
+        return best
+
+    # narrows the score window with null-window searches until the exact score is known
+    def _solve(self, current, occupied, moves):
+        cells = self.geometry.cells
+        low, high = -((cells - moves) // 2), (cells + 1 - moves) // 2
+        while low < high:
+            middle = low + (high - low) // 2
+            if 0 >= middle > low // 2:
+                middle = low // 2
+            elif 0 <= middle < high // 2:
+                middle = high // 2
+            score = self.negamax(current, occupied, moves, middle, middle + 1)
+            if score <= middle:
+                high = score
+            else:
+                low = score
+        return low
+
+    def negamax(self, current, occupied, moves, alpha, beta):
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            raise SolverBudgetExceeded()
+        geometry = self.geometry
+        cells = geometry.cells
+        if moves == cells:
+            return 0  # draw
+        playable = geometry.playable_cells(occupied)
+        winning_cells = geometry.winning_cells
+        if winning_cells(current, occupied) & playable:
+            return (cells + 1 - moves) // 2  # wins with the next move
+
+        opponent_wins = winning_cells(current ^ occupied, occupied)
+        forced = playable & opponent_wins
+        if forced:
+            if forced & (forced - 1):
+                return -((cells - moves) // 2)  # two threats cannot both be blocked
+            playable = forced
+        playable &= ~(opponent_wins >> 1)  # never plays directly below an opponent threat
+        if not playable:
+            return -((cells - moves) // 2)
+
+        high = (cells - 1 - moves) // 2  # cannot win sooner than the move after next
+        key = current + occupied
+        bound = self.table.get(key)
+        if bound is not None and bound < high:
+            high = bound
+        if beta > high:
+            beta = high
+            if alpha >= beta:
+                return beta
+
+        column_masks = geometry.column_masks
+        for col in geometry.centre_first:
+            move = playable & column_masks[col]
+            if move:
+                score = -self.negamax(current ^ occupied, occupied | move, moves + 1, -beta, -alpha)
+                if score >= beta:
+                    return score
+                if score > alpha:
+                    alpha = score
+
+        if len(self.table) >= self.table_size:
+            self.table.clear()
+        self.table[key] = alpha
+        return alpha
+
+
+# precomputed best moves stored in a compact binary file: a header followed by fixed-size records sorted by
+# position key, so a lookup is a binary search over a memory-mapped file without loading it.
+# keys are canonical (the smaller of a position's key and its mirror image's) and moves are stored for that
+# orientation, so a position and its mirror image share one record
+class OpeningBook:
+    MAGIC = b"C4BK"
+    HEADER = struct.Struct("<4sBBBBI")  # magic, format version, rows, columns, win length, number of records
+    RECORD = struct.Struct("<QBbB")  # position key, best move, score for the player to move, exact flag
+    # version 1 books held both orientations of every position, version 2 books did not store the win length
+    VERSION = 3
+
+    def __init__(self, entries=None, geometry=STANDARD):
+        self.geometry = geometry  # board size and win length of the positions in the book
+        self.entries = dict(entries or {})  # position key -> (move, score, exact), for books built in memory
+        self.data = None  # memory-mapped file contents, for loaded books
+        self.count = 0  # number of records in the mapped file
+        self.file = None
+
+    @classmethod
+    def load(cls, path):
+        # maps a book file into memory; records are read on demand
+        book = cls()
+        book.file = open(path, "rb")
+        book.data = mmap.mmap(book.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, rows, columns, connect, count = cls.HEADER.unpack_from(book.data, 0)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError(f"{path} is not an opening book in format version {cls.VERSION}")
+        book.geometry = get_geometry(rows, columns, connect)
+        book.count = count
+        return book
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.file.close()
+            self.data = self.file = None
+
+    def save(self, path):
+        # writes the in-memory entries, sorted by key
+        geometry = self.geometry
+        if geometry.bits > 64:
+            raise ValueError(f"Position keys of a {geometry} board do not fit in the 64-bit book records")
+        with open(path, "wb") as file:
+            file.write(self.HEADER.pack(self.MAGIC, self.VERSION, geometry.rows, geometry.columns, geometry.connect,
+                                        len(self.entries)))
+            for key in sorted(self.entries):
+                move, score, exact = self.entries[key]
+                file.write(self.RECORD.pack(key, move, score, exact))
+
+    def __len__(self):
+        return len(self.entries) if self.data is None else self.count
+
+    # returns (move, score, exact) for a canonical position key, or None
+    def entry(self, key):
+        if self.data is None:
+            return self.entries.get(key)
+        low, high = 0, self.count
+        offset = self.HEADER.size
+        while low < high:
+            middle = (low + high) // 2
+            record_key, move, score, exact = self.RECORD.unpack_from(self.data, offset + middle * self.RECORD.size)
+            if record_key == key:
+                return move, score, bool(exact)
+            if record_key < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    # returns the book move for the game's position, or None if the position is not in the book
+    # (or the game is played on another board)
+    def lookup(self, game):
+        geometry = game.geometry
+        if geometry is not self.geometry:
+            return None
+        key = game.position_key()
+        mirrored_key = geometry.mirror_mask(key)
+        entry = self.entry(min(key, mirrored_key))
+        if entry is None:
+            return None
+        return geometry.mirror_column(entry[0]) if mirrored_key < key else entry[0]
+
+
+# enumerates every position reachable in at most depth plies (skipping finished games) and stores a best move
+# for each; moves come from the exact solver when it finishes within max_nodes, otherwise from fallback(game)
+# (marked as inexact), and positions with neither are left out
+def build_book(game, depth, max_nodes=None, fallback=None, progress=None):
+    solver = Solver(max_nodes)
+    geometry = game.geometry
+    entries = {}
+    frontier = [game.copy()]
+    for ply in range(depth + 1):
+        next_frontier = {}
+        for position in frontier:
+            key = position.position_key()
+            mirrored_key = geometry.mirror_mask(key)
+            canonical_key = min(key, mirrored_key)
+            if canonical_key in entries:
+                continue
+            try:
+                move, score = solver.best_move(position)
+                exact = True
+            except SolverBudgetExceeded:
+                move = fallback(position) if fallback is not None else None
+                score, exact = 0, False
+            if move is not None:
+                entries[canonical_key] = (geometry.mirror_column(move) if mirrored_key < key else move, score, exact)
+            if progress is not None:
+                progress(ply, len(entries))
+            if ply == depth:
+                continue
+            for col in position.get_valid_moves():
+                child = position.copy()
+                child.make_move(col, child.players[child.current_player_index].marker)
+                child.current_player_index = (child.current_player_index + 1) % 2
+                if not child.is_terminal():
+                    next_frontier.setdefault(child.canonical_position_key(), child)
+        frontier = list(next_frontier.values())
+    return OpeningBook(entries, geometry)
+
+
+def main():
+    # local imports: player.py uses this module, so importing it at the top would be circular
+    from connect_four_game import ConnectFour
+    from player import Player, NegamaxAgent
+
+    parser = argparse.ArgumentParser(description="Builds an opening book file for the Connect Four agents.")
+    parser.add_argument("output", help="path of the book file to write")
+    parser.add_argument("--depth", type=int, default=4, help="number of plies from the start to cover")
+    parser.add_argument("--max-nodes", type=int, default=200000,
+                        help="solver node budget per position before falling back to the negamax agent")
+    parser.add_argument("--fallback-time", type=float, default=1.0,
+                        help="seconds the negamax agent gets for positions the solver cannot finish, 0 to skip them")
+    parser.add_argument("--rows", type=int, default=6, help="rows of the board")
+    parser.add_argument("--columns", type=int, default=7, help="columns of the board")
+    parser.add_argument("--connect", type=int, default=4, help="markers in a row needed to win")
+    args = parser.parse_args()
+
+    fallback = None
+    if args.fallback_time > 0:
+        def fallback(position):
+            agent = NegamaxAgent(position.players[position.current_player_index].marker, args.fallback_time)
+            return agent.make_move(position)
+
+    game = ConnectFour(Player("X"), Player("O"), args.rows, args.columns, args.connect)
+    book = build_book(game, args.depth, args.max_nodes, fallback,
+                      lambda ply, size: print(f"\rply {ply}: {size} positions", end="", flush=True))
+    print()
+    book.save(args.output)
+    exact = sum(1 for _, _, is_exact in book.entries.values() if is_exact)
+    print(f"Wrote {len(book)} positions ({exact} solved exactly) to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import random
+
+from mcts import MonteCarloTreeSearch
+
+
+# stand-in for a player when a position is sent to a worker process; the search only needs the markers,
+# and the real players (which may hold their own search trees or process pools) cannot always be pickled
+class Seat:
+    def __init__(self, marker):
+        self.marker = marker
+
+
+# copies a game state with its players replaced by seats, so it can be pickled for a worker process
+def detached_copy(game_state):
+    state = game_state.copy()
+    state.players = [Seat(player.marker) for player in state.players]
+    return state
+
+
+# splits a total amount of work into near-equal shares, one per worker, dropping empty shares
+def split_work(total, workers):
+    share, extra = divmod(total, workers)
+    return [share + (1 if i < extra else 0) for i in range(workers) if share or i < extra]
+
+
+# worker process entry point for root parallelisation: runs an independent search and returns root statistics
+def _root_search_worker(state, iterations, time_limit, early_stop, exploration_constant, transposition_table_size,
+                        seed, rollout_policy="random", rave_equivalence=0, widening_exponent=None):
+    random.seed(seed)
+    search = MonteCarloTreeSearch(state, exploration_constant, transposition_table_size,
+                                  rollout_policy=rollout_policy, rave_equivalence=rave_equivalence,
+                                  widening_exponent=widening_exponent)
+    search.run_search(iterations, time_limit, early_stop)
+    root = search.root
+    return search.iterations_completed, [(move, child.visits, child.wins)
+                                         for move, child in zip(root.child_moves, root.children)]
+
+
+# worker process entry point for leaf parallelisation: runs a share of the playouts for one leaf
+def _playout_worker(state, playouts, seed, rollout_policy="random"):
+    random.seed(seed)
+    return MonteCarloTreeSearch(state, rollout_policy=rollout_policy).simulate_many(playouts)
+
+
+# root parallelisation: every worker grows its own tree from the same position, and the trees are
+# merged by summing the visits and wins of each root move
+class RootParallelSearch:
+    def __init__(self, game_state, executor, workers, exploration_constant=1.41, transposition_table_size=None,
+                 rollout_policy="random", rave_equivalence=0, widening_exponent=None):
+        self.state = detached_copy(game_state)  # position sent to every worker
+        self.executor = executor  # process pool running the independent searches
+        self.workers = workers  # number of independent trees
+        self.exploration_constant = exploration_constant
+        self.transposition_table_size = transposition_table_size
+        self.rollout_policy = rollout_policy  # sent to the workers, so a name or a picklable policy object
+        self.rave_equivalence = rave_equivalence  # RAVE and widening settings of every worker's search
+        self.widening_exponent = widening_exponent
+        self.root_statistics = {}  # move -> [visits, wins] summed over all trees
+        self.iterations_completed = 0  # iterations run by all workers in the last run_search call
+
+    def run_search(self, iterations=None, time_limit=None, early_stop=False):
+        # splits the iteration budget between the workers; a time limit applies to each worker as a whole
+        if iterations is None and time_limit is None:
+            raise ValueError("run_search needs an iteration count, a time limit or both")
+        shares = split_work(iterations, self.workers) if iterations is not None else [None] * self.workers
+        futures = [
+            self.executor.submit(_root_search_worker, self.state, share, time_limit, early_stop,
+                                 self.exploration_constant, self.transposition_table_size, random.getrandbits(64),
+                                 self.rollout_policy, self.rave_equivalence, self.widening_exponent)
+            for share in shares
+        ]
+        self.root_statistics = {}
+        self.iterations_completed = 0
+        for future in futures:
+            completed, edges = future.result()
+            self.iterations_completed += completed
+            for move, visits, wins in edges:
+                statistics = self.root_statistics.setdefault(move, [0, 0])
+                statistics[0] += visits
+                statistics[1] += wins
+        return self.best_move()
+
+    def best_move(self):
+        # returns the root move with the best merged win rate
+        visited = [(wins / visits, move) for move, (visits, wins) in self.root_statistics.items() if visits]
+        if not visited:
+            valid_moves = self.state.get_valid_moves()
+            return valid_moves[-1] if valid_moves else None
+        return max(visited)[1]
+
+
+# leaf parallelisation: a single tree is grown in this process, and the playouts for every selected leaf
+# are run as one batch spread over the worker processes; the workers only return result counts, so the
+# search cannot use RAVE
+class LeafParallelSearch(MonteCarloTreeSearch):
+    def __init__(self, game_state, executor, workers, playouts_per_leaf, exploration_constant=1.41,
+                 transposition_table_size=None, profiler=None, rollout_policy="random", widening_exponent=None):
+        super().__init__(game_state, exploration_constant, transposition_table_size, playouts_per_leaf, profiler,
+                         rollout_policy, widening_exponent=widening_exponent)
+        self.executor = executor  # process pool running the playouts
+        self.workers = workers  # number of processes each batch is split over
+
+    def simulate_batch(self):
+        # spreads the leaf's playouts over the worker processes and adds up their counts
+        if self.state.is_terminal():
+            # no need to involve the workers, every playout ends immediately
+            return {self.state.get_result(): self.playouts_per_leaf}
+        leaf = detached_copy(self.state)
+        futures = [self.executor.submit(_playout_worker, leaf, share, random.getrandbits(64), self.rollout_policy)
+                   for share in split_work(self.playouts_per_leaf, self.workers)]
+        counts = {}
+        for future in futures:
+            for result, count in future.result().items():
+                counts[result] = counts.get(result, 0) + count
+        return counts
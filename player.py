@@ -1,11 +1,41 @@
+import os
 import random
-from mcts import MCTSNode, MonteCarloTreeSearch
+import time
+from concurrent.futures import ProcessPoolExecutor
+from mcts import MonteCarloTreeSearch
+from opening_book import OpeningBook, Solver, SolverBudgetExceeded
+from parallel_mcts import RootParallelSearch, LeafParallelSearch
 
 
 # base class for a player, to be extended by specific player types (human, AI).
 class Player:
-    def __init__(self, marker):
+    endgame_node_budget = 200000  # solver positions per endgame move before falling back to the agent's search
+    profiler = None  # instrumentation.Profiler recording this agent's moves, set by Profiler.attach
+
+    def __init__(self, marker, book=None, endgame_cells=0):
         self.marker = marker  # player's marker ("X" or "O")
+        self.book = book  # OpeningBook, or the path of a book file that is loaded on first use
+        self.endgame_cells = endgame_cells  # positions with at most this many empty cells are solved exactly
+        self.solver = None  # endgame solver, created on first use so its table is kept between moves
+
+    # returns a move from the opening book or the endgame solver, or None when the agent has to search
+    def known_move(self, game):
+        if self.book is not None:
+            if isinstance(self.book, str):
+                self.book = OpeningBook.load(self.book)
+            move = self.book.lookup(game)
+            if move is not None and game.is_valid_move(move):
+                return move
+        if self.endgame_cells and game.geometry.cells - game.move_count <= self.endgame_cells:
+            if self.solver is None:
+                self.solver = Solver(self.endgame_node_budget)
+            try:
+                solved = self.solver.best_move(game)
+            except SolverBudgetExceeded:
+                return None
+            if solved is not None:
+                return solved[0]
+        return None
 
     def make_move(self, board):
         pass  # to be implemented by subclasses
@@ -14,13 +44,14 @@ class Player:
 # human player
 class HumanPlayer(Player):
     def make_move(self, board):
+        columns = board.geometry.columns
         while True:
             try:
-                column_choice = int(input(f"Player {self.marker}'s turn. Choose a column (1-7): ")) - 1
-                if 0 <= column_choice < 7 and board.is_valid_move(column_choice):
+                column_choice = int(input(f"Player {self.marker}'s turn. Choose a column (1-{columns}): ")) - 1
+                if 0 <= column_choice < columns and board.is_valid_move(column_choice):
                     return column_choice
                 else:
-                    print("Invalid column. Please choose a column between 1 and 7, and ensure it's not full.")
+                    print(f"Invalid column. Please choose a column between 1 and {columns}, and ensure it's not full.")
             except ValueError:
                 print("Please enter a number.")  # non-integer input
 
@@ -29,7 +60,7 @@ class HumanPlayer(Player):
 class RandomAIAgent(Player):
     def make_move(self, board):
         # generates a list of valid columns
-        valid_columns = [col for col in range(7) if board.is_valid_move(col)]
+        valid_columns = [col for col in range(board.geometry.columns) if board.is_valid_move(col)]
         # randomly selects from valid columns if any are available
         if valid_columns:
             return random.choice(valid_columns)
@@ -39,85 +70,111 @@ class RandomAIAgent(Player):
 
 # an implementation of an AI agent inspired by A*
 class AStarAgent(Player):
-    def __init__(self, marker):
-        super().__init__(marker)
+    turn_bonus = 16  # constant bonus added to every evaluation
+    cache_size = 100000  # entries the evaluation cache holds before it is cleared
+    # cache shared by all A* agents in the process, so the work carries over between the games of a tournament;
+    # it is keyed on canonical hashes, so mirrored positions share an entry (the evaluation is symmetric).
+    # chosen moves are not cached: a cache hit would have to offer the same tie list in the same order as a fresh
+    # search for seeded games to replay identically
+    evaluation_cache = {}  # (canonical hash, geometry, markers) -> heuristic evaluation
+
+    def __init__(self, marker, book=None, endgame_cells=0):
+        super().__init__(marker, book, endgame_cells)
         # assigns the opponent's marker based on the agent's own marker
         self.opponent_marker = 'O' if marker == 'X' else 'X'
+        # (marker, first player's marker, second player's marker, win length) -> window score table
+        self.window_scores = {}
 
     def heuristic_evaluation(self, game, marker):
-        score = 0  # initializes the score to 0
-
-        # adds the turn bonus
-        turn_bonus = 16
-
-        # loops through each cell on the board
-        for row in range(6):
-            for col in range(7):
-                # horizontal segments
-                if col + 3 < 7:
-                    score += self.evaluate_segment(game, row, col, 0, 1, marker)
-                # vertical segments
-                if row + 3 < 6:
-                    score += self.evaluate_segment(game, row, col, 1, 0, marker)
-                # ascending diagonal
-                if row - 3 >= 0 and col + 3 < 7:
-                    score += self.evaluate_segment(game, row, col, -1, 1, marker)
-                # descending diagonal
-                if row + 3 < 6 and col + 3 < 7:
-                    score += self.evaluate_segment(game, row, col, 1, 1, marker)
-
-        # adds the turn bonus to the total score
-        return score + turn_bonus
-
-    # helper method to evaluate a segment of four cells
-    def evaluate_segment(self, game, row, col, d_row, d_col, marker):
-        # creates a segment of four cells based on the direction specified by d_row and d_col
-        segment = [game.board[row + i * d_row][col + i * d_col] for i in range(4)]
-        # assigns a score to the segment based on its composition
-        return self.score_segment(segment, marker, self.opponent_marker)
-
-    # assigns a score to the segment based on its composition
+        # scores every window of connect cells on the board and adds the turn bonus
+        key = (game.canonical_hash(), game.geometry, marker, self.opponent_marker, game.players[0].marker,
+               game.players[1].marker)
+        score = self.evaluation_cache.get(key)
+        if score is None:
+            if len(self.evaluation_cache) >= self.cache_size:
+                self.evaluation_cache.clear()
+            score = self.evaluation_cache[key] = self.score_windows(game, game.geometry.windows, marker) + self.turn_bonus
+        return score
+
+    # sums the scores of the given windows (bitboard masks of connect cells)
+    def score_windows(self, game, windows, marker):
+        scores = self.window_score_table(game, marker)
+        first_mask, second_mask = game.masks
+        return sum(scores[(first_mask & window).bit_count()][(second_mask & window).bit_count()]
+                   for window in windows)
+
+    # table of window scores indexed by the number of markers of each player in the window,
+    # filled in once per marker with score_segment so the segment weights stay in one place
+    def window_score_table(self, game, marker):
+        connect = game.geometry.connect
+        key = (marker, game.players[0].marker, game.players[1].marker, connect)
+        scores = self.window_scores.get(key)
+        if scores is None:
+            scores = [[self.score_segment([key[1]] * first + [key[2]] * second + ['-'] * (connect - first - second),
+                                          marker, self.opponent_marker) if first + second <= connect else 0
+                       for second in range(connect + 1)]
+                      for first in range(connect + 1)]
+            self.window_scores[key] = scores
+        return scores
+
+    # places a marker and updates running window totals (one per marker in perspectives)
+    # by rescoring only the windows that pass through the new cell
+    def make_scored_move(self, game, col, marker, totals, perspectives):
+        windows = game.geometry.cell_windows[game.geometry.cell_index(col, game.heights[col])]
+        before = [self.score_windows(game, windows, perspective) for perspective in perspectives]
+        game.make_move(col, marker)
+        return [total + self.score_windows(game, windows, perspective) - previous
+                for total, perspective, previous in zip(totals, perspectives, before)]
+
+    # assigns a score to the segment based on its composition: a full line, or a line missing one, two or three
+    # markers with the rest of the segment empty (segments are as long as the win length, four by default)
     def score_segment(self, segment, marker, opponent_marker):
-        if segment.count(marker) == 4 and segment.count('-') == 0:
-            return 512
-        elif segment.count(marker) == 3 and segment.count('-') == 1:
-            return 50
-        elif segment.count(marker) == 2 and segment.count('-') == 2:
-            return 10
-        elif segment.count(marker) == 1 and segment.count('-') == 3:
-            return 1
-        elif segment.count(opponent_marker) == 4 and segment.count('-') == 0:
-            return -512
-        elif segment.count(opponent_marker) == 3 and segment.count('-') == 1:
-            return -50
-        elif segment.count(opponent_marker) == 2 and segment.count('-') == 2:
-            return -10
-        elif segment.count(opponent_marker) == 1 and segment.count('-') == 3:
-            return -1
+        length = len(segment)
+        empty = segment.count('-')
+        for missing, score in ((0, 512), (1, 50), (2, 10), (3, 1)):
+            if empty == missing < length:
+                if segment.count(marker) == length - missing:
+                    return score
+                if segment.count(opponent_marker) == length - missing:
+                    return -score
         return 0
 
-    # simulates the opponent's best possible move and returns its score
-    def simulate_opponent_best_move(self, game):
+    # simulates the opponent's best possible move and returns its score,
+    # optionally starting from the opponent's window total for the current position
+    def simulate_opponent_best_move(self, game, opponent_total=None):
+        if opponent_total is None:
+            opponent_total = self.score_windows(game, game.geometry.windows, self.opponent_marker)
         best_opponent_score = float('-inf')  # initializes to the lowest possible score
         for col in game.get_valid_moves():  # iterates through all valid moves
-            temp_game = game.copy()  # makes a copy of the game to simulate the move
-            temp_game.make_move(col, self.opponent_marker)  # simulates the opponent's move
-            score = self.heuristic_evaluation(temp_game, self.opponent_marker)  # evaluates the board after the move
+            # simulates the opponent's move and evaluates the board after it
+            score = self.make_scored_move(game, col, self.opponent_marker, [opponent_total],
+                                          [self.opponent_marker])[0] + self.turn_bonus
+            game.unmake_move(col)  # takes the simulated move back
             if score > best_opponent_score:  # if the move is better than the current best, updates the best score
                 best_opponent_score = score
         return best_opponent_score  # returns the best score achievable by the opponent
 
     # chooses the best move based on the agent's heuristic evaluation
     def make_move(self, game):
+        known_move = self.known_move(game)  # opening book or endgame solver
+        if known_move is not None:
+            return known_move
+
+        geometry = game.geometry
         best_score = float('-inf')  # initializes the best score to the lowest possible score
         best_moves = []  # initializes a list to keep track of the best moves
 
+        # scores the current position once, from both sides; each simulated move only rescores its own windows
+        perspectives = [self.marker, self.opponent_marker]
+        totals = [self.score_windows(game, geometry.windows, perspective) for perspective in perspectives]
+
         # evaluates each valid move
         for col in game.get_valid_moves():
-            temp_game = game.copy()  # copy the game to simulate the move
-            temp_game.make_move(col, self.marker)  # makes the simulated move
-            current_score = self.heuristic_evaluation(temp_game, self.marker)  # evaluates the move's score
-            opponent_best_score = self.simulate_opponent_best_move(temp_game)  # simulates the opponent's best response
+            own_total, opponent_total = self.make_scored_move(game, col, self.marker, totals, perspectives)
+            current_score = own_total + self.turn_bonus  # evaluates the move's score
+            # simulates the opponent's best response
+            opponent_best_score = self.simulate_opponent_best_move(game, opponent_total)
+            game.unmake_move(col)  # takes the simulated move back
             effective_score = current_score - opponent_best_score  # calculates the effective score considering the
             # opponent's best move
 
@@ -132,10 +189,233 @@ class AStarAgent(Player):
         return random.choice(best_moves) if best_moves else -1
 
 
+# raised inside NegamaxAgent's search when the time budget for the move runs out
+class SearchTimeout(Exception):
+    pass
+
+
+# agent that searches with negamax and alpha-beta pruning, deepening one ply at a time until its time budget runs out
+# leaf positions are scored with the A* agent's segment weights (512/50/10/1), and a transposition table keyed on the
+# canonical position hash remembers scores and best moves between iterations and between moves
+class NegamaxAgent(AStarAgent):
+    WIN_SCORE = 1000000  # score of a won position, reduced by the number of plies needed to win
+    EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2  # kinds of transposition table scores
+
+    def __init__(self, marker, time_limit=0.1, max_depth=None, table_size=200000, book=None, endgame_cells=0):
+        super().__init__(marker, book, endgame_cells)
+        self.time_limit = time_limit  # seconds per move
+        self.max_depth = max_depth  # deepest iteration, None to search until the board is full
+        self.table_size = table_size  # the table is cleared when it grows beyond this many positions
+        # canonical position hash -> (depth, score, kind, best move in the canonical orientation)
+        self.table = {}
+        self.history = []  # moves of the game the table belongs to
+        self.deadline = None
+        self.nodes = 0  # positions visited during the last move
+
+    def make_move(self, game):
+        if game.moves[:len(self.history)] != self.history:
+            self.table.clear()  # scores are relative to this agent's marker, so they cannot carry over between games
+        self.history = game.moves[:]
+        known_move = self.known_move(game)  # opening book or endgame solver
+        if known_move is not None:
+            return known_move
+
+        search_game = game.copy()  # a timeout can leave the searched copy mid-line
+        markers = (self.marker, self.opponent_marker)
+        self.deadline = time.perf_counter() + self.time_limit
+        self.nodes = 0
+        moves = [col for col in game.geometry.centre_first if game.is_valid_move(col)]
+        if not moves:
+            return -1
+        best_move = moves[0]
+        cells = game.geometry.cells
+        max_depth = cells - game.move_count if self.max_depth is None else self.max_depth
+        for depth in range(1, max_depth + 1):
+            try:
+                score, move = self.search_root(search_game, depth, markers)
+            except SearchTimeout:
+                break  # keeps the move of the last completed iteration
+            best_move = move
+            if abs(score) >= self.WIN_SCORE - cells:
+                break  # a forced win or loss has been found, deeper searches cannot change it
+        return best_move
+
+    # searches every move at the root and returns the best score with its move
+    def search_root(self, game, depth, markers):
+        best_score, best_move = float('-inf'), None
+        alpha, beta = -self.WIN_SCORE - 1, self.WIN_SCORE + 1
+        for col in self.ordered_moves(game):
+            game.make_move(col, markers[0])
+            if game.winner is not None:
+                score = self.WIN_SCORE - 1
+            else:
+                score = -self.negamax(game, depth - 1, -beta, -alpha, 1, markers, 2)
+            game.unmake_move(col)
+            if score > best_score:
+                best_score, best_move = score, col
+            alpha = max(alpha, score)
+        self.store(game, depth, best_score, self.EXACT, best_move)
+        return best_score, best_move
+
+    # returns the score of the position for the player to move (turn 0 is this agent, turn 1 its opponent)
+    def negamax(self, game, depth, alpha, beta, turn, markers, ply):
+        self.nodes += 1
+        if self.nodes % 256 == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        if game.is_draw():
+            return 0
+        if depth == 0:
+            score = self.heuristic_evaluation(game, self.marker)
+            return score if turn == 0 else -score
+
+        original_alpha = alpha
+        entry = self.probe(game)
+        if entry is not None and entry[0] >= depth:
+            _, score, kind, _ = entry
+            if kind == self.EXACT:
+                return score
+            if kind == self.LOWER_BOUND:
+                alpha = max(alpha, score)
+            else:
+                beta = min(beta, score)
+            if alpha >= beta:
+                return score
+
+        best_score, best_move = float('-inf'), None
+        for col in self.ordered_moves(game, entry[3] if entry is not None else None):
+            game.make_move(col, markers[turn])
+            if game.winner is not None:
+                score = self.WIN_SCORE - ply  # sooner wins score higher
+            else:
+                score = -self.negamax(game, depth - 1, -beta, -alpha, 1 - turn, markers, ply + 1)
+            game.unmake_move(col)
+            if score > best_score:
+                best_score, best_move = score, col
+            alpha = max(alpha, score)
+            if alpha >= beta:
+                break  # the opponent will avoid this line, so the remaining moves cannot matter
+
+        if best_score <= original_alpha:
+            kind = self.UPPER_BOUND
+        elif best_score >= beta:
+            kind = self.LOWER_BOUND
+        else:
+            kind = self.EXACT
+        self.store(game, depth, best_score, kind, best_move)
+        return best_score
+
+    # valid moves, centre first, with the table's best move for the position tried before all others
+    def ordered_moves(self, game, first=None):
+        if first is None:
+            entry = self.probe(game)
+            first = entry[3] if entry is not None else None
+        # columns in the order they are tried, central columns first
+        moves = [col for col in game.geometry.centre_first if col != first and game.is_valid_move(col)]
+        if first is not None and game.is_valid_move(first):
+            moves.insert(0, first)
+        return moves
+
+    # returns the table entry of a position, with its best move mapped to the position's orientation
+    def probe(self, game):
+        entry = self.table.get(game.canonical_hash())
+        if entry is not None and entry[3] is not None and game.is_mirrored():
+            entry = entry[:3] + (game.geometry.mirror_column(entry[3]),)
+        return entry
+
+    # records a search result, starting a fresh table when the size limit is reached
+    def store(self, game, depth, score, kind, best_move):
+        if len(self.table) >= self.table_size:
+            self.table.clear()
+        if best_move is not None and game.is_mirrored():
+            best_move = game.geometry.mirror_column(best_move)
+        self.table[game.canonical_hash()] = (depth, score, kind, best_move)
+
+
 # agent that uses the MCTS strategy
 class MCTSAgent(Player):
+    def __init__(self, marker, iterations=100, exploration_constant=1.41, transposition_table_size=None,
+                 reuse_tree=True, time_limit=None, early_stop=False, parallel=None, workers=None,
+                 playouts_per_leaf=None, book=None, endgame_cells=0, rollout_policy="random", rave_equivalence=0,
+                 widening_exponent=None):
+        super().__init__(marker, book, endgame_cells)
+        if parallel not in (None, "root", "leaf"):
+            raise ValueError(f"Unknown parallel mode {parallel!r}, expected None, 'root' or 'leaf'")
+        if parallel == "leaf" and rave_equivalence:
+            raise ValueError("RAVE needs the moves of every playout, which the 'leaf' parallel mode does not return")
+        if parallel == "leaf" and playouts_per_leaf is not None and playouts_per_leaf < 2:
+            # single playouts are run by the search itself, so the workers would never be used
+            raise ValueError("The 'leaf' parallel mode needs at least 2 playouts per leaf to spread over the workers")
+        self.iterations = iterations  # number of MCTS iterations per move, None to search for time_limit only
+        self.time_limit = time_limit  # wall-clock budget per move in seconds, None for no limit
+        self.early_stop = early_stop  # stops searching once the best move can no longer change
+        self.exploration_constant = exploration_constant  # UCT exploration constant
+        # when set, positions reached by different move orders share one node in a table of this size
+        self.transposition_table_size = transposition_table_size
+        self.reuse_tree = reuse_tree  # keeps the search tree between moves
+        self.search = None  # search used for the most recent move
+        # "root" merges independent trees grown in worker processes, "leaf" spreads each leaf's playouts over them
+        self.parallel = parallel
+        self.workers = workers or os.cpu_count() or 1  # number of worker processes for the parallel modes
+        # playouts per selected leaf: spread over the workers in "leaf" mode (8 by default), otherwise run
+        # through the numpy batch playout engine from batch_playout.MIN_PLAYOUTS on (1 by default)
+        if playouts_per_leaf is None:
+            playouts_per_leaf = 8 if parallel == "leaf" else 1
+        self.playouts_per_leaf = playouts_per_leaf
+        # how simulations choose their moves: "random", "tactical" (wins, else blocks, else random) or "heuristic"
+        self.rollout_policy = rollout_policy
+        # RAVE: visits after which a move's own win rate outweighs its all-moves-as-first win rate, 0 to disable
+        self.rave_equivalence = rave_equivalence
+        # progressive widening: a node with n visits gets at most n ** widening_exponent + 1 children, None for all
+        self.widening_exponent = widening_exponent
+        self.executor = None  # process pool, created on the first parallel search
+
+    # returns the agent's process pool, starting it if needed
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    # shuts down the agent's process pool, if it has one
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    # moves the previous search forward to the current position, or returns None if it cannot be reused
+    def reuse_search(self, game):
+        search = self.search
+        if search is None:
+            return None
+        played = search.state.moves
+        if game.moves[:len(played)] != played:
+            return None  # a different game, or moves were taken back
+        for move in game.moves[len(played):]:
+            if not search.advance(move):
+                return None  # the reply was never explored, so there is no subtree to keep
+        if search.state.masks != game.masks or search.state.current_player_index != game.current_player_index:
+            return None
+        return search
+
     def make_move(self, game):
-        root = MCTSNode(game)
-        mcts = MonteCarloTreeSearch(root)
-        best_move = mcts.run_search(iterations=100)
+        known_move = self.known_move(game)  # opening book or endgame solver
+        if known_move is not None:
+            return known_move
+
+        # root-parallel trees live in the worker processes, so there is no tree to carry over
+        mcts = self.reuse_search(game) if self.reuse_tree and self.parallel != "root" else None
+        if mcts is None:
+            if self.parallel == "root":
+                mcts = RootParallelSearch(game, self.get_executor(), self.workers, self.exploration_constant,
+                                          self.transposition_table_size, self.rollout_policy, self.rave_equivalence,
+                                          self.widening_exponent)
+            elif self.parallel == "leaf":
+                mcts = LeafParallelSearch(game, self.get_executor(), self.workers, self.playouts_per_leaf,
+                                          self.exploration_constant, self.transposition_table_size, self.profiler,
+                                          self.rollout_policy, self.widening_exponent)
+            else:
+                mcts = MonteCarloTreeSearch(game, self.exploration_constant, self.transposition_table_size,
+                                            self.playouts_per_leaf, self.profiler, self.rollout_policy,
+                                            self.rave_equivalence, self.widening_exponent)
+        best_move = mcts.run_search(self.iterations, self.time_limit, self.early_stop)
+        self.search = mcts
         return best_move
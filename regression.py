@@ -0,0 +1,284 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+
+from connect_four_game import ConnectFour, get_geometry
+from game_records import GameRecordReader, GameRecordWriter
+from opening_book import OpeningBook, Solver, build_book
+from player import Player
+
+# boards the engine checks run on: the standard one and a few other sizes and win lengths
+GEOMETRIES = [get_geometry(), get_geometry(5, 4, 3), get_geometry(7, 8), get_geometry(9, 10, 5)]
+
+
+# plain list-of-lists board with the original row-by-row win scan, the reference the bitboards are checked against
+class ReferenceBoard:
+    def __init__(self, rows, columns, connect):
+        self.rows, self.columns, self.connect = rows, columns, connect
+        self.board = [["-" for _ in range(columns)] for _ in range(rows)]  # top row first
+
+    def is_valid_move(self, column):
+        return 0 <= column < self.columns and self.board[0][column] == "-"
+
+    def make_move(self, column, marker):
+        for row in reversed(range(self.rows)):
+            if self.board[row][column] == "-":
+                self.board[row][column] = marker
+                return
+
+    def check_win(self, marker):
+        for row in range(self.rows):
+            for col in range(self.columns):
+                for d_row, d_col in ((0, 1), (1, 0), (1, 1), (-1, 1)):
+                    end_row, end_col = row + d_row * (self.connect - 1), col + d_col * (self.connect - 1)
+                    if not (0 <= end_row < self.rows and 0 <= end_col < self.columns):
+                        continue
+                    if all(self.board[row + d_row * step][col + d_col * step] == marker
+                           for step in range(self.connect)):
+                        return True
+        return False
+
+
+def new_game(geometry):
+    return ConnectFour(Player('X'), Player('O'), geometry.rows, geometry.columns, geometry.connect)
+
+
+def play(game, column):
+    game.make_move(column, game.players[game.current_player_index].marker)
+    game.current_player_index = (game.current_player_index + 1) % 2
+
+
+# plays random games to a full board on every geometry, comparing the bitboard engine with the reference board
+# after every move: the board view, legal moves, wins of both players, the first winner, draws, taking moves back
+# and the mirror hash
+def check_engine(rng, games):
+    failures = []
+    for geometry in GEOMETRIES:
+        for game_index in range(games):
+            game = new_game(geometry)
+            mirror = new_game(geometry)
+            reference = ReferenceBoard(geometry.rows, geometry.columns, geometry.connect)
+            winner = None
+            while game.move_count < geometry.cells:
+                column = rng.choice(game.get_valid_moves())
+                marker = game.players[game.current_player_index].marker
+                if game.winner is None:  # taking a move back clears the winner, so won games are not resumed
+                    before = (game.masks[:], game.heights[:], game.hash, game.mirror_hash)
+                    play(game, column)
+                    game.unmake_move(column)
+                    game.current_player_index = (game.current_player_index + 1) % 2
+                    if (game.masks, game.heights, game.hash, game.mirror_hash, game.winner) != before + (None,):
+                        failures.append(f"{geometry}: unmake_move({column}) after {game.moves} did not restore "
+                                        f"the position")
+                        break
+                play(game, column)
+                play(mirror, geometry.mirror_column(column))
+                reference.make_move(column, marker)
+                if winner is None and reference.check_win(marker):
+                    winner = marker
+                where = f"{geometry} game {game_index} after {game.moves}"
+                if game.board != reference.board:
+                    failures.append(f"{where}: board differs from the reference")
+                elif any(game.is_valid_move(col) != reference.is_valid_move(col)
+                         for col in range(-1, geometry.columns + 1)):
+                    failures.append(f"{where}: legal moves differ from the reference")
+                elif any(game.check_win(player) != reference.check_win(player) for player in "XO"):
+                    failures.append(f"{where}: check_win differs from the reference")
+                elif game.winner != winner:
+                    failures.append(f"{where}: winner {game.winner!r}, expected {winner!r}")
+                elif game.is_draw() != (game.move_count == geometry.cells):
+                    failures.append(f"{where}: is_draw is wrong")
+                elif (mirror.hash, mirror.mirror_hash) != (game.mirror_hash, game.hash):
+                    failures.append(f"{where}: the mirror image's hashes do not match")
+                else:
+                    continue
+                break
+    return failures
+
+
+# exact score of a position for the player to move by full minimax, on the solver's scale
+def minimax(game, table):
+    key = game.position_key()
+    if key in table:
+        return table[key]
+    cells = game.geometry.cells
+    moves = game.move_count
+    best = None
+    for column in game.get_valid_moves():
+        play(game, column)
+        if game.winner is not None:
+            score = (cells + 1 - moves) // 2
+        elif game.move_count == cells:
+            score = 0
+        else:
+            score = -minimax(game, table)
+        game.current_player_index = (game.current_player_index + 1) % 2
+        game.unmake_move(column)
+        if best is None or score > best:
+            best = score
+    table[key] = best
+    return best
+
+
+# random unfinished positions with the given number of empty cells
+def late_positions(rng, geometry, empty_cells, count):
+    positions = []
+    while len(positions) < count:
+        game = new_game(geometry)
+        while game.winner is None and game.move_count < geometry.cells - empty_cells:
+            play(game, rng.choice(game.get_valid_moves()))
+        if game.winner is None:
+            positions.append(game)
+    return positions
+
+
+# compares the solver's scores and best moves with full minimax on late positions
+def check_solver(rng, positions):
+    failures = []
+    solver = Solver()
+    for geometry, empty_cells in ((get_geometry(), 14), (get_geometry(5, 4, 3), 12), (get_geometry(4, 5), 12)):
+        for game in late_positions(rng, geometry, empty_cells, positions):
+            table = {}
+            expected = minimax(game, table)
+            where = f"{geometry} after {game.moves}"
+            score = solver.solve(game)
+            column, best_score = solver.best_move(game)
+            child = game.copy()
+            play(child, column)
+            if child.winner is not None:
+                column_score = (geometry.cells + 1 - game.move_count) // 2
+            else:
+                column_score = 0 if child.move_count == geometry.cells else -minimax(child, table)
+            if score != expected:
+                failures.append(f"{where}: solve gave {score}, minimax {expected}")
+            elif best_score != expected or column_score != expected:
+                failures.append(f"{where}: best_move gave column {column} with {best_score}, which scores "
+                                f"{column_score} against {expected}")
+    return failures
+
+
+# writes random games to a record file in two sessions (the second appends to the first) and checks every field
+# read back, and that a file is not appended to with another geometry
+def check_records(rng, games, directory):
+    failures = []
+    for geometry in (get_geometry(), get_geometry(9, 10, 5)):
+        path = os.path.join(directory, f"games-{geometry.rows}x{geometry.columns}.c4gr")
+        written = []
+        for names in (("random", "astar"), ("astar", "mcts:iterations=100")):
+            with GameRecordWriter(path, buffer_size=256, geometry=geometry) as writer:
+                for index in range(games):
+                    game = new_game(geometry)
+                    while not game.is_terminal():
+                        play(game, rng.choice(game.get_valid_moves()))
+                    player1, player2 = names if index % 2 == 0 else names[::-1]
+                    record = (player1, player2, game.get_result(), game.moves, rng.getrandbits(64),
+                              rng.random())
+                    writer.write(*record)
+                    written.append(record)
+        with GameRecordReader(path) as reader:
+            if reader.geometry is not geometry:
+                failures.append(f"{path}: read back as {reader.geometry!r}, written as {geometry!r}")
+            read = list(reader)
+        if len(read) != len(written):
+            failures.append(f"{path}: {len(read)} games read back, {len(written)} written")
+        for index, (record, expected) in enumerate(zip(read, written)):
+            if tuple(record[:5]) != expected[:5] or abs(record.duration - expected[5]) > 1e-6:
+                failures.append(f"{path}: game {index} read back as {record}, written as {expected}")
+                break
+        try:
+            GameRecordWriter(path, geometry=get_geometry(connect=5)).close()
+            failures.append(f"{path}: appending games on another geometry was not rejected")
+        except ValueError:
+            pass
+    return failures
+
+
+# saves and loads opening books and checks that the loaded book gives the built book's moves for every position
+# in it and for their mirror images, and that its exact moves score what the solver says. books are built from a
+# late position on the standard board, the empty 5x4 connect-3 board and the empty 7x8 board (64-bit keys), which
+# gets too few solver nodes to solve anything and takes its moves from the first free column instead
+def check_book(rng, depth, directory):
+    failures = []
+    solver = Solver()
+    books = [(late_positions(rng, get_geometry(), 20, 1)[0], None), (new_game(get_geometry(5, 4, 3)), None),
+             (new_game(get_geometry(7, 8)), 200)]
+    for index, (root, max_nodes) in enumerate(books):
+        geometry = root.geometry
+        path = os.path.join(directory, f"book-{index}.bin")
+        built = build_book(root, depth, max_nodes, lambda position: position.get_valid_moves()[0])
+        built.save(path)
+        loaded = OpeningBook.load(path)
+        try:
+            if len(loaded) != len(built) or loaded.geometry is not geometry:
+                failures.append(f"{path}: loaded {len(loaded)} positions on {loaded.geometry!r}, saved "
+                                f"{len(built)} on {geometry!r}")
+            frontier = [root]
+            for ply in range(depth + 1):
+                next_frontier = []
+                for game in frontier:
+                    mirror = new_game(geometry)
+                    for column in game.moves:
+                        play(mirror, geometry.mirror_column(column))
+                    move = loaded.lookup(game)
+                    # a position that is its own mirror image keeps the same move
+                    symmetric = game.position_key() == mirror.position_key()
+                    entry = loaded.entry(game.canonical_position_key())
+                    if move is None or move != built.lookup(game):
+                        failures.append(f"{path}: after {game.moves} the loaded book gives {move}, the built one "
+                                        f"{built.lookup(game)}")
+                    elif loaded.lookup(mirror) != (move if symmetric else geometry.mirror_column(move)):
+                        failures.append(f"{path}: the mirror image of {game.moves} gives {loaded.lookup(mirror)} "
+                                        f"for the move {move}")
+                    elif entry[2]:
+                        child = game.copy()
+                        play(child, move)
+                        if child.winner is not None:
+                            score = (geometry.cells + 1 - game.move_count) // 2
+                        else:
+                            score = 0 if child.move_count == geometry.cells else -solver.solve(child)
+                        if score != entry[1]:
+                            failures.append(f"{path}: the book move {move} after {game.moves} scores {score}, "
+                                            f"not {entry[1]}")
+                    if ply < depth:
+                        for column in game.get_valid_moves():
+                            child = game.copy()
+                            play(child, column)
+                            if not child.is_terminal():
+                                next_frontier.append(child)
+                frontier = next_frontier
+        finally:
+            loaded.close()
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Checks the bitboard engine, the exact solver and the game record "
+                                                 "and opening book files against reference implementations.")
+    parser.add_argument("--games", type=int, default=50, help="random games per board for the engine and records")
+    parser.add_argument("--positions", type=int, default=20, help="late positions per board for the solver")
+    parser.add_argument("--depth", type=int, default=4, help="plies of the opening books built")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the random games and positions")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        checks = {
+            "engine": lambda: check_engine(rng, args.games),
+            "solver": lambda: check_solver(rng, args.positions),
+            "records": lambda: check_records(rng, args.games, directory),
+            "book": lambda: check_book(rng, args.depth, directory),
+        }
+        for name, check in checks.items():
+            failures = check()
+            print(f"{name:10} {'FAILED' if failures else 'ok'}")
+            for failure in failures:
+                print(f"  {failure}")
+            failed = failed or bool(failures)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
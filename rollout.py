@@ -0,0 +1,133 @@
+import random
+
+
+# result of a position that is already over ("draw" for a full board), or None while the game goes on
+def finished_result(state):
+    if state.winner is not None:
+        return state.winner
+    if state.move_count == state.geometry.cells:
+        return "draw"
+    return None
+
+
+# rollout policies play a game to the end from a position and return its result (a marker, or "draw");
+# they work on copies of the raw bitboards and never modify the state they are given.
+# when given a moves list, they append every column they play to it (for the search's AMAF statistics).
+# batchable marks policies whose playouts the vectorised numpy engine in batch_playout.py can run instead
+
+# plays uniformly random moves, checking the mover's bitboard for a line after every move
+class RandomRollout:
+    name = "random"
+    batchable = True
+
+    def playout(self, state, moves=None):
+        result = finished_result(state)
+        if result is not None:
+            return result
+        geometry = state.geometry
+        rows, column_height, has_line = geometry.rows, geometry.column_height, geometry.has_line
+        masks = state.masks[:]
+        heights = state.heights[:]
+        open_columns = state.get_valid_moves()
+        index = state.current_player_index
+        choice = random.choice
+        while open_columns:
+            column = choice(open_columns)
+            if moves is not None:
+                moves.append(column)
+            mask = masks[index] | 1 << (column * column_height + heights[column])
+            masks[index] = mask
+            heights[column] += 1
+            if heights[column] == rows:
+                open_columns.remove(column)
+            if has_line(mask):
+                return state.players[index].marker
+            index ^= 1
+        return "draw"
+
+
+# wins when a move completes a line, otherwise blocks the opponent's immediate win, otherwise plays randomly.
+# immediate wins are found with winning_cells on the bitboards, so a move that gets played never completes a line
+# and the board is never checked for one
+class TacticalRollout:
+    name = "tactical"
+    batchable = False
+
+    def playout(self, state, moves=None):
+        result = finished_result(state)
+        if result is not None:
+            return result
+        geometry = state.geometry
+        rows, column_height = geometry.rows, geometry.column_height
+        playable_cells, winning_cells = geometry.playable_cells, geometry.winning_cells
+        masks = state.masks[:]
+        heights = state.heights[:]
+        open_columns = state.get_valid_moves()
+        index = state.current_player_index
+        while True:
+            current, opponent = masks[index], masks[1 - index]
+            occupied = current | opponent
+            playable = playable_cells(occupied)
+            wins = winning_cells(current, occupied) & playable
+            if wins:
+                if moves is not None:
+                    moves.append(((wins & -wins).bit_length() - 1) // column_height)
+                return state.players[index].marker
+            threats = winning_cells(opponent, occupied)
+            blocks = threats & playable
+            if blocks:
+                # with two threats the block does not save the game, but the playout still plays it out
+                column = ((blocks & -blocks).bit_length() - 1) // column_height
+            else:
+                column = self.choose_column(geometry, open_columns, heights, threats)
+            if moves is not None:
+                moves.append(column)
+            masks[index] = current | 1 << (column * column_height + heights[column])
+            heights[column] += 1
+            if heights[column] == rows:
+                open_columns.remove(column)
+                if not open_columns:
+                    return "draw"
+            index ^= 1
+
+    # column of the move when there is nothing to win or block
+    def choose_column(self, geometry, open_columns, heights, threats):
+        return random.choice(open_columns)
+
+
+# tactical policy whose other moves avoid the cell right below an opponent threat (which would let the opponent
+# win on top of it) and prefer cells that lie on many winning windows, i.e. central and low cells
+class HeuristicRollout(TacticalRollout):
+    name = "heuristic"
+
+    def __init__(self):
+        # per geometry, the weight of every cell: the number of windows that pass through it
+        # (from 3 in the corners to 13 in the centre of the standard board)
+        self.cell_weights = {}
+
+    def choose_column(self, geometry, open_columns, heights, threats):
+        cell_weights = self.cell_weights.get(geometry)
+        if cell_weights is None:
+            cell_weights = self.cell_weights[geometry] = [len(windows) for windows in geometry.cell_windows]
+        columns = []
+        weights = []
+        for col in open_columns:
+            cell = col * geometry.column_height + heights[col]
+            if not threats >> (cell + 1) & 1:
+                columns.append(col)
+                weights.append(cell_weights[cell])
+        if not columns:
+            return random.choice(open_columns)  # every move gives a win away
+        return random.choices(columns, weights)[0]
+
+
+ROLLOUT_POLICIES = {policy.name: policy for policy in (RandomRollout, TacticalRollout, HeuristicRollout)}
+
+
+# accepts a policy name (see ROLLOUT_POLICIES) or a policy object, and returns a policy object
+def get_rollout_policy(policy):
+    if not isinstance(policy, str):
+        return policy
+    if policy not in ROLLOUT_POLICIES:
+        raise ValueError(f"Unknown rollout policy {policy!r}, expected one of {sorted(ROLLOUT_POLICIES)}")
+    return ROLLOUT_POLICIES[policy]()
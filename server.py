@@ -0,0 +1,313 @@
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from connect_four_game import ConnectFour
+from player import Player, MCTSAgent, NegamaxAgent
+from tournament import AGENTS, AgentConfig, load_configs
+
+TIMED_AGENTS = (MCTSAgent, NegamaxAgent)  # agents taking a time_limit option
+TIME_LIMIT_SHARE = 0.8  # part of the move deadline given to timed agents, the rest covers process overhead
+# agent options clients may set; the others (process pools, book files, endgame solving) would let a client use
+# server resources freely, so only presets (see GameServer) can set them
+CLIENT_OPTIONS = ("iterations", "exploration_constant", "rollout_policy", "time_limit", "max_depth")
+MAX_QUEUED_REQUESTS = 16  # requests a connection can send ahead of its replies before the server stops reading
+
+
+# rebuilds a game from its moves, with plain players standing in for the seats
+def replay(moves):
+    game = ConnectFour(Player('X'), Player('O'))
+    for column in moves:
+        game.make_move(column, game.players[game.current_player_index].marker)
+        game.current_player_index = (game.current_player_index + 1) % 2
+    return game
+
+
+# runs in a worker process: creates the agent and asks it for a move in the replayed position
+def compute_move(config, moves):
+    game = replay(moves)
+    agent = config.create(game.players[game.current_player_index].marker)
+    try:
+        return agent.make_move(game)
+    finally:
+        if hasattr(agent, "close"):
+            agent.close()
+
+
+# raised for requests the server cannot honour; its message is sent back to the client
+class ProtocolError(Exception):
+    pass
+
+
+# one game between a client and an agent
+class Session:
+    def __init__(self, session_id, config, human_marker, deadline):
+        self.id = session_id
+        self.config = config  # AgentConfig of the agent the client plays against
+        self.human_marker = human_marker  # marker played by the client
+        self.deadline = deadline  # seconds the agent gets per move
+        self.game = replay([])
+        self.lock = asyncio.Lock()  # moves of one session are handled one at a time
+        self.pending = None  # future of the agent move being computed, so it can be cancelled
+
+    def describe(self):
+        game = self.game
+        return {
+            "session": self.id,
+            "moves": game.moves,
+            "board": ["".join(row) for row in game.board],
+            "to_move": None if game.is_terminal() else game.players[game.current_player_index].marker,
+            "result": game.get_result() if game.is_terminal() else None,
+        }
+
+
+# asyncio server managing many concurrent sessions; agent moves run in a process pool with a per-move deadline.
+# timed agents get a time limit inside the deadline and other options cannot lift it, so searches end in time;
+# a move that still misses its deadline (e.g. a slow worker start) is replaced by the fallback move, but the
+# worker cannot be interrupted and stays busy until the move finishes, delaying queued moves if every worker is
+# busy. a close or a dropped connection ends the session at once and drops its move if no worker has started it.
+# an agent that fails ends its session with an error reply
+# protocol: one JSON object per line in each direction, requests carry an "op" field:
+#   {"op": "new", "agent": "mcts", "options": {...}, "human": "X", "deadline": 1.0}  (options from CLIENT_OPTIONS)
+#   {"op": "move", "session": 1, "column": 3}
+#   {"op": "state", "session": 1}
+#   {"op": "close", "session": 1}
+# sessions can only be played, read and closed on the connection that opened them.
+# every reply has "ok" and either the session state or an "error" message
+class GameServer:
+    def __init__(self, workers=None, default_deadline=2.0, presets=(), max_deadline=10.0):
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = self.start_executor()
+        self.default_deadline = default_deadline  # seconds per agent move when the client does not choose
+        self.max_deadline = max_deadline  # longest deadline a client may ask for
+        # named agent configurations (e.g. written by tuner.py) clients can ask for next to the plain agent names
+        self.presets = {config.name: config for config in presets}
+        self.sessions = {}
+        self.session_ids = itertools.count(1)
+        self.timeouts = 0  # agent moves replaced by the fallback move after missing their deadline
+
+    def start_executor(self):
+        # spawned rather than forked workers, so they do not inherit the open client sockets and keep
+        # connections alive after the server closes them
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    # reads the connection's requests while a separate task answers them in order, so a close or a dropped
+    # connection is seen while an agent move is pending and cancels it
+    async def handle_connection(self, reader, writer):
+        owned = []  # sessions opened on this connection, closed when it drops
+        requests = asyncio.Queue(MAX_QUEUED_REQUESTS)
+        answering = asyncio.create_task(self.answer_requests(requests, owned, writer))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError as error:
+                    request = error  # answered in turn
+                if isinstance(request, dict) and request.get("op") == "close" and request.get("session") in owned:
+                    self.close_session(request["session"])
+                await requests.put(request)
+        except ConnectionError:
+            pass
+        finally:
+            for session_id in owned:
+                self.close_session(session_id)
+            answering.cancel()
+            writer.close()
+
+    async def answer_requests(self, requests, owned, writer):
+        while True:
+            request = await requests.get()
+            try:
+                if isinstance(request, ValueError):
+                    raise request  # the line was not valid JSON
+                reply = {"ok": True, **await self.handle_request(request, owned)}
+            except (ProtocolError, ValueError, TypeError) as error:
+                reply = {"ok": False, "error": str(error)}
+            try:
+                writer.write((json.dumps(reply) + "\n").encode())
+                await writer.drain()
+            except ConnectionError:
+                return
+
+    async def handle_request(self, request, owned):
+        if not isinstance(request, dict):
+            raise ProtocolError("Requests must be JSON objects")
+        op = request.get("op")
+        if op == "new":
+            session = self.new_session(request)
+            owned.append(session.id)
+            async with session.lock:
+                await self.play_agent_turn(session)
+                return session.describe()
+        session_id = request.get("session")
+        # sessions are numbered in order, so a connection only gets at the sessions it opened itself
+        if session_id not in owned:
+            raise ProtocolError(f"Unknown session {session_id!r}")
+        if op == "close":
+            self.close_session(session_id)  # usually done already, when the request was read
+            return {"session": session_id, "closed": True}
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise ProtocolError(f"Session {session_id} is closed")
+        if op == "move":
+            async with session.lock:
+                self.play_human_move(session, request.get("column"))
+                await self.play_agent_turn(session)
+                return session.describe()
+        if op == "state":
+            return session.describe()
+        raise ProtocolError(f"Unknown op {op!r}")
+
+    def new_session(self, request):
+        agent = request.get("agent", "mcts")
+        preset = self.presets.get(agent)
+        agent_type = preset.agent_type if preset is not None else AGENTS.get(agent)
+        if agent_type is None:
+            raise ProtocolError(f"Unknown agent {agent!r}, expected one of {sorted(AGENTS) + sorted(self.presets)}")
+        human_marker = request.get("human", "X")
+        if human_marker not in ("X", "O"):
+            raise ProtocolError("human must be 'X' or 'O'")
+        deadline = float(request.get("deadline", self.default_deadline))
+        if not 0 < deadline <= self.max_deadline:
+            raise ProtocolError(f"deadline must be above 0 and at most {self.max_deadline} seconds")
+        client_options = request.get("options", {})
+        if not isinstance(client_options, dict):
+            raise ProtocolError("options must be a JSON object")
+        refused = sorted(set(client_options) - set(CLIENT_OPTIONS))
+        if refused:
+            raise ProtocolError(f"Options {refused} cannot be set by clients, expected some of {list(CLIENT_OPTIONS)}")
+        options = dict(preset.options if preset is not None else {}, **client_options)
+        if agent_type in TIMED_AGENTS:
+            # searches that can stop on a clock aim to finish well inside the deadline; a requested time limit
+            # can only shorten that
+            time_limit = deadline * TIME_LIMIT_SHARE
+            if options.get("time_limit", time_limit) is None:
+                raise ProtocolError(f"{agent_type.__name__} needs a time limit to meet the move deadline")
+            options["time_limit"] = min(float(options.get("time_limit", time_limit)), time_limit)
+        config = AgentConfig(agent_type, **options)
+        config.create(human_marker)  # fails here, with the client's error, if the options are invalid
+        session = Session(next(self.session_ids), config, human_marker, deadline)
+        self.sessions[session.id] = session
+        return session
+
+    def play_human_move(self, session, column):
+        game = session.game
+        if game.is_terminal():
+            raise ProtocolError("The game is over")
+        if game.players[game.current_player_index].marker != session.human_marker:
+            raise ProtocolError("It is not your turn")
+        if not isinstance(column, int) or not game.is_valid_move(column):
+            raise ProtocolError(f"Invalid column {column!r}")
+        self.apply_move(game, column)
+
+    async def play_agent_turn(self, session):
+        game = session.game
+        if game.is_terminal() or game.players[game.current_player_index].marker == session.human_marker:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            # submitting fails too once a worker has died
+            pending = session.pending = loop.run_in_executor(self.executor, compute_move, session.config,
+                                                             list(game.moves))
+            done, _ = await asyncio.wait([pending], timeout=session.deadline)
+            column = pending.result() if done and not pending.cancelled() else None
+        except BrokenProcessPool as error:
+            # a worker died; later moves get a fresh pool
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = self.start_executor()
+            self.close_session(session.id)
+            raise ProtocolError(f"The agent's worker process failed ({error}), session {session.id} closed")
+        except Exception as error:
+            self.close_session(session.id)
+            raise ProtocolError(f"The agent failed ({error!r}), session {session.id} closed")
+        finally:
+            session.pending = None
+        if not done:
+            # the worker cannot be interrupted, but the session does not wait for it
+            pending.cancel()
+            self.timeouts += 1
+        elif pending.cancelled():
+            raise ProtocolError(f"Session {session.id} was closed during the agent's move")
+        if column is None or not game.is_valid_move(column):
+            # fallback when the agent misses its deadline: the first free column from the centre
+            column = next(col for col in game.geometry.centre_first if game.is_valid_move(col))
+        self.apply_move(game, column)
+
+    @staticmethod
+    def apply_move(game, column):
+        game.make_move(column, game.players[game.current_player_index].marker)
+        game.current_player_index = (game.current_player_index + 1) % 2
+        game.game_over = game.is_terminal()
+
+    def close_session(self, session_id):
+        session = self.sessions.pop(session_id, None)
+        if session is not None and session.pending is not None:
+            session.pending.cancel()  # drops the move if it has not started in a worker yet
+
+    async def serve(self, host="127.0.0.1", port=8765, unix_path=None):
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+# minimal client for the JSON-lines protocol, e.g. for scripts and local tests
+class GameClient:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=8765, unix_path=None):
+        if unix_path is not None:
+            reader, writer = await asyncio.open_unix_connection(unix_path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def request(self, **request):
+        self.writer.write((json.dumps(request) + "\n").encode())
+        await self.writer.drain()
+        return json.loads(await self.reader.readline())
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves Connect Four games against the agents over JSON lines.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="listens on this Unix socket path instead of TCP")
+    parser.add_argument("--workers", type=int, help="agent worker processes (default: one per CPU)")
+    parser.add_argument("--deadline", type=float, default=2.0, help="default seconds per agent move")
+    parser.add_argument("--max-deadline", type=float, default=10.0, help="longest deadline a client may ask for")
+    parser.add_argument("--presets", help="JSON file of named agent configurations, e.g. written by tuner.py")
+    args = parser.parse_args()
+
+    server = GameServer(args.workers, args.deadline, load_configs(args.presets) if args.presets else (),
+                        args.max_deadline)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
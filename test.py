@@ -1,47 +1,23 @@
-import time
+import argparse
 import csv
-from connect_four_game import ConnectFour
 from player import RandomAIAgent, AStarAgent, MCTSAgent
+from tournament import simulate_games
 
 
-def append_simulation_results(file_name, configuration, wins_for_X, wins_for_O, draws, average_duration):
-    with open(file_name, mode='a', newline='') as file:
-        writer = csv.writer(file)
-        # Write the configuration and results
-        writer.writerow([configuration, wins_for_X, wins_for_O, draws, average_duration])
-
-
-# simulates a given number of games between two player types, tracking wins and draws
-def simulate_games(num_games, player1_type, player2_type):
-    wins_for_X = 0
-    wins_for_O = 0
-    draws = 0
-
-    for _ in range(num_games):
-        player1 = player1_type('X')
-        player2 = player2_type('O')
-        game = ConnectFour(player1, player2)
-
-        while not game.game_over:
-            current_player = game.players[game.current_player_index]
-            column_choice = current_player.make_move(game)
-
-            if game.make_move(column_choice, current_player.marker):
-                if game.check_win(current_player.marker):
-                    if current_player.marker == 'X':
-                        wins_for_X += 1
-                    else:
-                        wins_for_O += 1
-                    game.game_over = True
-                elif game.is_draw():
-                    draws += 1
-                    game.game_over = True
-            game.current_player_index = (game.current_player_index + 1) % 2
-
-    return wins_for_X, wins_for_O, draws
+def append_simulation_results(writer, configuration, wins_for_X, wins_for_O, draws, average_duration):
+    # Write the configuration and results
+    writer.writerow([configuration, wins_for_X, wins_for_O, draws, average_duration])
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Simulates games between agent configurations and appends the "
+                                                 "results to a csv file.")
+    parser.add_argument("--output", default="agents_performance.csv", help="csv file the results are appended to")
+    parser.add_argument("--games", type=int, default=1000, help="number of games per configuration")
+    parser.add_argument("--seed", type=int, default=0, help="seed the per-game seeds are derived from")
+    parser.add_argument("--record", help="game record file every simulated game is appended to")
+    args = parser.parse_args()
+
     configurations = [
         # {"player1_type": RandomAIPlayer, "player2_type": RandomAIPlayer},
         {"player1_type": RandomAIAgent, "player2_type": MCTSAgent, "iterations": 100},
@@ -50,31 +26,29 @@ def main():
         {"player1_type": MCTSAgent, "player2_type": AStarAgent, "iterations": 100},
 
     ]
-    file_name = "agents_performance_c_1_41*1000.csv"
+    file_name = args.output
 
-    # checks if file exists to write the header, otherwise append
-    try:
-        with open(file_name, 'x', newline='') as file:
-            writer = csv.writer(file)
+    # the csv file is opened once for the whole run; the header is only written to a new file
+    with open(file_name, mode='a', newline='') as file:
+        writer = csv.writer(file)
+        if file.tell() == 0:
             writer.writerow(["Configuration", "Wins for X", "Wins for O", "Draws", "Average Game Duration"])
-    except FileExistsError:
-        pass  # file already exists, proceed with appending data
 
-    for config in configurations:
-        num_games = 1000  # or however many games you want to simulate for each configuration
-        total_duration = 0
+        for config in configurations:
+            num_games = args.games  # number of games to simulate for each configuration
 
-        # simulate the games first, accumulating the results
-        start_time = time.time()
-        wins_for_X, wins_for_O, draws = simulate_games(num_games, config["player1_type"], config["player2_type"])
-        end_time = time.time()
-        total_duration = end_time - start_time
+            # simulate the games first, accumulating the results; the games run in parallel, so the average
+            # comes from each game's own duration rather than the elapsed time
+            wins_for_X, wins_for_O, draws, total_duration = simulate_games(
+                num_games, config["player1_type"], config["player2_type"], seed=args.seed, record_path=args.record)
 
-        average_duration = total_duration / num_games
-        # configuration_description = f"{config['player1_type'].__name__} vs {config['player2_type'].__name__}"
-        configuration_description = f"{config['player1_type'].__name__} vs {config['player2_type'].__name__}, {config['iterations']} iterations"
+            average_duration = total_duration / num_games
+            # configuration_description = f"{config['player1_type'].__name__} vs {config['player2_type'].__name__}"
+            configuration_description = f"{config['player1_type'].__name__} vs {config['player2_type'].__name__}, {config['iterations']} iterations"
 
-        append_simulation_results(file_name, configuration_description, wins_for_X, wins_for_O, draws, average_duration)
+            append_simulation_results(writer, configuration_description, wins_for_X, wins_for_O, draws,
+                                      average_duration)
+            file.flush()  # keeps finished configurations on disk if a later one is interrupted
 
 
 if __name__ == "__main__":
@@ -0,0 +1,197 @@
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import permutations
+
+from connect_four_game import STANDARD, ConnectFour
+from game_records import GameRecordWriter
+from player import RandomAIAgent, AStarAgent, MCTSAgent, NegamaxAgent
+
+# agent types by the names configurations refer to them with
+AGENTS = {
+    "random": RandomAIAgent,
+    "astar": AStarAgent,
+    "mcts": MCTSAgent,
+    "negamax": NegamaxAgent,
+}
+AGENT_NAMES = {agent_type: name for name, agent_type in AGENTS.items()}
+
+
+# an agent type together with the options it is created with, e.g. AgentConfig(MCTSAgent, iterations=1000);
+# configurations are sent to worker processes, which create fresh agents for every game.
+# they can be written as text ("mcts:iterations=1000,rollout_policy=tactical") or as JSON objects
+# ({"agent": "mcts", "options": {"iterations": 1000}}), so settings can be kept in files instead of the source
+class AgentConfig:
+    def __init__(self, agent_type, name=None, **options):
+        self.agent_type = agent_type  # Player subclass to instantiate
+        self.options = options  # keyword arguments passed to the agent after its marker
+        self.name = name or self.describe()  # label used in results
+
+    # builds a readable label such as "MCTSAgent(iterations=1000)"
+    def describe(self):
+        if not self.options:
+            return self.agent_type.__name__
+        options = ", ".join(f"{key}={value}" for key, value in sorted(self.options.items()))
+        return f"{self.agent_type.__name__}({options})"
+
+    # creates a fresh agent playing with the given marker
+    def create(self, marker):
+        return self.agent_type(marker, **self.options)
+
+    def to_dict(self):
+        if self.agent_type not in AGENT_NAMES:
+            raise ValueError(f"{self.agent_type.__name__} has no name in tournament.AGENTS")
+        return {"agent": AGENT_NAMES[self.agent_type], "name": self.name, "options": dict(self.options)}
+
+    @classmethod
+    def from_dict(cls, data):
+        agent_type = AGENTS.get(data.get("agent"))
+        if agent_type is None:
+            raise ValueError(f"Unknown agent {data.get('agent')!r}, expected one of {sorted(AGENTS)}")
+        return cls(agent_type, data.get("name"), **data.get("options", {}))
+
+    # parses "agent" or "agent:option=value,..."; values are read as JSON where possible, as strings otherwise
+    @classmethod
+    def parse(cls, text):
+        agent, _, options_text = text.partition(":")
+        options = {}
+        for item in filter(None, options_text.split(",")):
+            key, separator, value = item.partition("=")
+            if not separator:
+                raise ValueError(f"Expected option=value, got {item!r} in {text!r}")
+            try:
+                options[key.strip()] = json.loads(value)
+            except ValueError:
+                options[key.strip()] = value.strip()
+        return cls.from_dict({"agent": agent.strip(), "options": options})
+
+
+# reads a list of agent configurations from a JSON file
+def load_configs(path):
+    with open(path) as file:
+        return [AgentConfig.from_dict(data) for data in json.load(file)]
+
+
+# writes agent configurations to a JSON file that load_configs reads back
+def save_configs(configs, path):
+    with open(path, "w") as file:
+        json.dump([config.to_dict() for config in configs], file, indent=2)
+
+
+# accepts either an AgentConfig or a bare agent type
+def as_config(agent):
+    return agent if isinstance(agent, AgentConfig) else AgentConfig(agent)
+
+
+# plays one game between two agents without displaying it, and returns the finished game;
+# when given a think_times list, the seconds each player spends choosing its moves are added to it
+def play_game(player1, player2, geometry=STANDARD, think_times=None):
+    game = ConnectFour(player1, player2, geometry.rows, geometry.columns, geometry.connect)
+    while not game.is_terminal():
+        current_player = game.players[game.current_player_index]
+        start_time = time.perf_counter()
+        column_choice = current_player.make_move(game)
+        if think_times is not None:
+            think_times[game.current_player_index] += time.perf_counter() - start_time
+        game.make_move(column_choice, current_player.marker)
+        game.current_player_index = (game.current_player_index + 1) % 2
+    game.game_over = True
+    for player in game.players:
+        if hasattr(player, "close"):
+            player.close()  # releases any process pool the agent started
+    return game
+
+
+# derives the seed of one game from the tournament seed, so every game can be replayed on its own
+def game_seed(seed, pairing_index, game_index):
+    return random.Random(f"{seed}-{pairing_index}-{game_index}").getrandbits(64)
+
+
+# plays one seeded game between two configurations and returns a summary of it; runs in the worker processes
+def play_seeded_game(config1, config2, seed, pairing_index=0, geometry=STANDARD):
+    random.seed(seed)
+    start_time = time.perf_counter()
+    think_times = [0.0, 0.0]
+    game = play_game(config1.create('X'), config2.create('O'), geometry, think_times)
+    return {
+        "pairing": pairing_index,
+        "player1": config1.name,
+        "player2": config2.name,
+        "seed": seed,
+        "result": game.get_result(),
+        "moves": game.moves,
+        "duration": time.perf_counter() - start_time,
+        "think_times": think_times,  # seconds spent choosing moves, by player1 and by player2
+    }
+
+
+# plays games_per_pairing games for every (player1, player2) pairing on a process pool,
+# yielding each game's summary as soon as it finishes (so not necessarily in submission order);
+# games are played on the given board geometry, e.g. get_geometry(9, 10) or get_geometry(connect=5)
+def run_games(pairings, games_per_pairing, workers=None, seed=0, geometry=STANDARD):
+    pairings = [(as_config(config1), as_config(config2)) for config1, config2 in pairings]
+    jobs = [(config1, config2, game_seed(seed, pairing_index, game_index), pairing_index, geometry)
+            for pairing_index, (config1, config2) in enumerate(pairings)
+            for game_index in range(games_per_pairing)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        # plays in this process, which keeps tracebacks simple and avoids the pool start-up cost
+        for job in jobs:
+            yield play_seeded_game(*job)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(play_seeded_game, *job) for job in jobs]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+# plays every configuration against every other one, with both colours, streaming game summaries
+def round_robin(configs, games_per_pairing, workers=None, seed=0, geometry=STANDARD):
+    return run_games(permutations(configs, 2), games_per_pairing, workers, seed, geometry)
+
+
+# adds up wins for X, wins for O and draws per pairing from a stream of game summaries
+def summarize(results):
+    summary = {}
+    for result in results:
+        totals = summary.setdefault((result["player1"], result["player2"]),
+                                    {"games": 0, "X": 0, "O": 0, "draw": 0, "duration": 0.0})
+        totals["games"] += 1
+        totals[result["result"]] += 1
+        totals["duration"] += result["duration"]
+    return summary
+
+
+# passes a stream of game summaries through, appending every game to a game record file on the way
+# (the geometry has to be the one the games were played on)
+def record_games(results, path, geometry=STANDARD):
+    with GameRecordWriter(path, geometry=geometry) as writer:
+        for result in results:
+            writer.write_summary(result)
+            yield result
+
+
+# simulates a given number of games between two player types, tracking wins, draws and the total duration
+# (the sum of the games' own durations, not the elapsed time, since they run in parallel);
+# with record_path, the full games are also appended to that game record file
+def simulate_games(num_games, player1_type, player2_type, workers=None, seed=0, record_path=None):
+    wins_for_X = 0
+    wins_for_O = 0
+    draws = 0
+    total_duration = 0.0
+
+    results = run_games([(player1_type, player2_type)], num_games, workers, seed)
+    if record_path is not None:
+        results = record_games(results, record_path)
+    for result in results:
+        if result["result"] == 'X':
+            wins_for_X += 1
+        elif result["result"] == 'O':
+            wins_for_O += 1
+        else:
+            draws += 1
+        total_duration += result["duration"]
+
+    return wins_for_X, wins_for_O, draws, total_duration
@@ -0,0 +1,169 @@
+import argparse
+import itertools
+import json
+import math
+import sys
+
+from player import MCTSAgent
+from tournament import AgentConfig, run_games, save_configs
+
+
+# one MCTS configuration per combination of exploration constant, search budget and rollout policy;
+# budgets are option dictionaries such as {"iterations": 300} or {"iterations": None, "time_limit": 0.05}
+def candidate_configs(exploration_constants, budgets, rollout_policies, agent_type=MCTSAgent, **fixed):
+    return [AgentConfig(agent_type, **fixed, exploration_constant=exploration_constant, rollout_policy=policy,
+                        **budget)
+            for exploration_constant, budget, policy in itertools.product(exploration_constants, budgets,
+                                                                          rollout_policies)]
+
+
+# plays every candidate against every reference with both colours, games_per_pairing games per colour, on the
+# tournament process pool, and returns per candidate name: the configuration, games, points (1 per win and
+# 0.5 per draw), the seconds it spent choosing moves and the number of moves it made
+def evaluate(candidates, references, games_per_pairing, workers=None, seed=0):
+    pairings = []
+    seats = []  # (candidate, seat of the candidate) of every pairing
+    for candidate in candidates:
+        for reference in references:
+            pairings += [(candidate, reference), (reference, candidate)]
+            seats += [(candidate, 0), (candidate, 1)]
+    stats = {candidate.name: {"config": candidate, "games": 0, "points": 0.0, "seconds": 0.0, "moves": 0}
+             for candidate in candidates}
+    for result in run_games(pairings, games_per_pairing, workers, seed):
+        candidate, seat = seats[result["pairing"]]
+        totals = stats[candidate.name]
+        totals["games"] += 1
+        if result["result"] == "draw":
+            totals["points"] += 0.5
+        elif result["result"] == "XO"[seat]:
+            totals["points"] += 1
+        totals["seconds"] += result["think_times"][seat]
+        totals["moves"] += (len(result["moves"]) + 1 - seat) // 2
+    return stats
+
+
+# adds the stats of a later evaluation to the accumulated ones
+def merge_stats(stats, new_stats):
+    for name, totals in new_stats.items():
+        if name not in stats:
+            stats[name] = totals
+            continue
+        for key in ("games", "points", "seconds", "moves"):
+            stats[name][key] += totals[key]
+    return stats
+
+
+# share of the points available in the games played
+def score(totals):
+    return totals["points"] / totals["games"] if totals["games"] else 0.0
+
+
+def seconds_per_move(totals):
+    return totals["seconds"] / totals["moves"] if totals["moves"] else 0.0
+
+
+# evaluates every candidate once with the same number of games
+def sweep(candidates, references, games_per_pairing, workers=None, seed=0):
+    return evaluate(candidates, references, games_per_pairing, workers, seed)
+
+
+# successive halving: evaluates all candidates with a few games, keeps the best 1 / eta of them by score and
+# evaluates those again with eta times as many games, until one is left or max_rounds rounds have been played.
+# the stats of every candidate cover all the rounds it took part in, so eliminated candidates are still reported
+# (with fewer games) and can sit on the Pareto frontier when they are cheap
+def successive_halving(candidates, references, games_per_pairing, eta=2, max_rounds=4, workers=None, seed=0):
+    stats = {}
+    survivors = list(candidates)
+    for round_index in range(max_rounds):
+        merge_stats(stats, evaluate(survivors, references, games_per_pairing * eta ** round_index, workers,
+                                    seed + round_index))
+        if len(survivors) == 1:
+            break
+        # ties go to the cheaper configuration
+        survivors.sort(key=lambda config: (-score(stats[config.name]), seconds_per_move(stats[config.name])))
+        survivors = survivors[:math.ceil(len(survivors) / eta)]
+    return stats
+
+
+# the candidates no other candidate beats on both strength and cost, from the cheapest to the strongest
+def pareto_frontier(stats):
+    frontier = []
+    for totals in sorted(stats.values(), key=lambda totals: (seconds_per_move(totals), -score(totals))):
+        if not frontier or score(totals) > score(frontier[-1]):
+            frontier.append(totals)
+    return frontier
+
+
+# formats the stats as a table sorted by cost, with the frontier marked by an asterisk
+def format_table(stats, frontier):
+    on_frontier = {id(totals) for totals in frontier}
+    width = max(len(totals["config"].name) for totals in stats.values())
+    lines = [f"  {'configuration':{width}} {'games':>6} {'score':>7} {'ms/move':>9}"]
+    for totals in sorted(stats.values(), key=seconds_per_move):
+        mark = "*" if id(totals) in on_frontier else " "
+        lines.append(f"{mark} {totals['config'].name:{width}} {totals['games']:6d} {score(totals):7.1%} "
+                     f"{seconds_per_move(totals) * 1000:9.2f}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tunes the MCTS agent against reference agents and reports the "
+                                                 "Pareto frontier of strength versus time per move.")
+    parser.add_argument("--exploration", type=float, nargs="+", default=[0.7, 1.0, 1.41, 2.12],
+                        help="exploration constants to try")
+    parser.add_argument("--iterations", type=int, nargs="*",
+                        help="iteration budgets per move to try (default: 100 300 1000, or none with --time-limits)")
+    parser.add_argument("--time-limits", type=float, nargs="*", default=[],
+                        help="time budgets per move in seconds to try, searching without an iteration limit")
+    parser.add_argument("--rollout", nargs="+", default=["random", "tactical"], help="rollout policies to try")
+    parser.add_argument("--reference", action="append",
+                        help="reference agent as agent[:option=value,...], e.g. mcts:iterations=100 "
+                             "(repeatable, default: astar and mcts:iterations=100)")
+    parser.add_argument("--method", choices=("halving", "sweep"), default="halving")
+    parser.add_argument("--games", type=int, default=4,
+                        help="games per reference and colour for every candidate (in the first halving round)")
+    parser.add_argument("--eta", type=int, default=2, help="halving keeps 1/eta of the candidates per round")
+    parser.add_argument("--rounds", type=int, default=4, help="maximum number of halving rounds")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument("--seed", type=int, default=0, help="seed the per-game seeds are derived from")
+    parser.add_argument("--output", help="writes the frontier configurations, named tuned-1 (cheapest) onwards, "
+                                         "to this JSON file (see tournament.load_configs and server.py --presets)")
+    parser.add_argument("--results", help="writes the stats of every candidate as JSON to this file")
+    args = parser.parse_args(argv)
+
+    if args.iterations is None:
+        args.iterations = [] if args.time_limits else [100, 300, 1000]
+    budgets = ([{"iterations": iterations} for iterations in args.iterations] +
+               [{"iterations": None, "time_limit": time_limit} for time_limit in args.time_limits])
+    if not budgets:
+        parser.error("needs at least one of --iterations and --time-limits")
+    candidates = candidate_configs(args.exploration, budgets, args.rollout)
+    references = [AgentConfig.parse(text) for text in args.reference or ["astar", "mcts:iterations=100"]]
+
+    if args.method == "halving":
+        stats = successive_halving(candidates, references, args.games, args.eta, args.rounds, args.workers,
+                                   args.seed)
+    else:
+        stats = sweep(candidates, references, args.games, args.workers, args.seed)
+    frontier = pareto_frontier(stats)
+
+    print(f"{len(candidates)} candidates against {', '.join(reference.name for reference in references)}")
+    print(format_table(stats, frontier))
+    print("Pareto frontier (cheapest first):")
+    tuned = []
+    for rank, totals in enumerate(frontier, 1):
+        config = totals["config"]
+        tuned.append(AgentConfig(config.agent_type, f"tuned-{rank}", **config.options))
+        print(f"  tuned-{rank}: {config.name}, {score(totals):.1%} at {seconds_per_move(totals) * 1000:.2f} ms/move")
+
+    if args.output:
+        save_configs(tuned, args.output)
+    if args.results:
+        with open(args.results, "w") as file:
+            json.dump([dict(totals, config=totals["config"].to_dict(), score=score(totals),
+                            seconds_per_move=seconds_per_move(totals)) for totals in stats.values()], file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())